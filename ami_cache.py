@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+'''Shared AMI metadata cache - batches describe_images and serves (image_location, ami_name, owner_id)'''
+import json
+import os
+import threading
+import time
+import logging
+from botocore.exceptions import ClientError
+
+from batch import batched
+from records import AmiInfo
+
+logger = logging.getLogger(__name__)
+
+IMAGE_BATCH_SIZE = 100 # image ids per describe_images call
+DEFAULT_TTL = 24 * 60 * 60 # seconds an on-disk entry stays valid
+NOT_FOUND = AmiInfo() # ("none", "none", "none"), the placeholder get_ami_info always returned
+NOT_FOUND_CODES = ('InvalidAMIID.NotFound', 'InvalidAMIID.Unavailable')
+
+
+class AmiResolver:
+    '''Thread-safe image_id -> records.AmiInfo (image_location, ami_name, owner_id) cache.
+
+    Lookups for the same image are only ever sent once: concurrent callers wait
+    on the request already in flight. prefetch() fills the cache for many ids
+    with as few describe_images calls as possible. With a cache_file, entries
+    younger than ttl seconds are loaded at start and written back by save().
+    '''
+    def __init__(self, cache_file=None, ttl=DEFAULT_TTL):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.api_calls = 0
+        self._images = {} # image_id -> (fetched_at, AmiInfo)
+        self._inflight = {} # image_id -> threading.Event
+        self._lock = threading.Lock()
+        if cache_file:
+            self.load(cache_file, ttl)
+
+    def load(self, cache_file, ttl=None):
+        '''Load unexpired entries from an on-disk cache written by save()'''
+        self.cache_file = cache_file
+        if ttl is not None:
+            self.ttl = ttl
+        try:
+            with open(cache_file) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except ValueError:
+            logger.warning("Ignoring unreadable AMI cache file %s", cache_file)
+            return 0
+        cutoff = time.time() - self.ttl
+        loaded = 0
+        with self._lock:
+            for image_id, (fetched_at, location, name, owner) in entries.items():
+                if fetched_at >= cutoff:
+                    self._images[image_id] = (fetched_at, AmiInfo(location, name, owner))
+                    loaded += 1
+        return loaded
+
+    def save(self, cache_file=None):
+        '''Write found images to the cache file, replacing it atomically'''
+        cache_file = cache_file or self.cache_file
+        if not cache_file:
+            return
+        with self._lock:
+            entries = {image_id: [fetched_at] + list(info)
+                       for image_id, (fetched_at, info) in self._images.items() if info != NOT_FOUND}
+        tmp = cache_file + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp, cache_file)
+
+    def cached(self, image_id):
+        '''Return cached info for image_id, or None'''
+        with self._lock:
+            entry = self._images.get(image_id)
+        return entry[1] if entry else None
+
+    def get(self, ec2_client, image_id):
+        '''Return (image_location, ami_name, owner_id), calling describe_images only on a miss'''
+        while True:
+            with self._lock:
+                entry = self._images.get(image_id)
+                if entry:
+                    return entry[1]
+                event = self._inflight.get(image_id)
+                if event is None:
+                    event = self._inflight[image_id] = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                event.wait() # someone else is fetching it; re-check the cache afterwards
+                continue
+            try:
+                self._describe(ec2_client, [image_id])
+            finally:
+                self._release([image_id])
+
+    def prefetch(self, ec2_client, image_ids):
+        '''Fetch every uncached image id in batches of IMAGE_BATCH_SIZE'''
+        with self._lock:
+            missing = sorted({i for i in image_ids if i and i not in self._images and i not in self._inflight})
+            for image_id in missing:
+                self._inflight[image_id] = threading.Event()
+        try:
+            for chunk in batched(missing, IMAGE_BATCH_SIZE):
+                try:
+                    self._describe(ec2_client, chunk)
+                finally:
+                    self._release(chunk)
+        finally:
+            self._release(missing) # wake waiters on any chunk skipped by an error
+        return len(missing)
+
+    def _release(self, image_ids):
+        with self._lock:
+            for image_id in image_ids:
+                event = self._inflight.pop(image_id, None)
+                if event:
+                    event.set()
+
+    def _describe(self, ec2_client, image_ids):
+        with self._lock:
+            self.api_calls += 1
+        try:
+            response = ec2_client.describe_images(ImageIds=image_ids)
+        except ClientError as err:
+            if err.response['Error']['Code'] not in NOT_FOUND_CODES:
+                raise
+            if len(image_ids) == 1:
+                response = {'Images': []}
+            else: # one bad id fails the whole batch - find it by asking one at a time
+                for image_id in image_ids:
+                    self._describe(ec2_client, [image_id])
+                return
+        found = {image['ImageId']: AmiInfo.from_api(image) for image in response.get('Images', [])}
+        now = time.time()
+        with self._lock:
+            for image_id in image_ids:
+                self._images[image_id] = (now, found.get(image_id, NOT_FOUND))
+
+
+resolver = AmiResolver() # process wide cache shared by asg_info and analyze_ami_tags
@@ -1,26 +1,40 @@
 #!/usr/bin/env python3
-import boto3
 import sys
 import pprint
 import logging
-from botocore.exceptions import ClientError
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import time
+from botocore.exceptions import BotoCoreError, ClientError
+import ami_cache
+import lt_catalog
+import lt_tags
+import aws_metrics
+import vendor_rules
+from asg_inventory import PAGE_SIZE, iter_asgs
+from aws_regions import MAX_POOL_CONNECTIONS, get_region_clients, run_regions
 
 logger = logging.getLogger(__name__)
 
 #REGIONS = ["us-west-2", "us-east-1"]
 REGIONS = ["us-west-2"]
+METRICS = "analyze-ami-tags-metrics"
+SCAN_CONCURRENCY = 16 # lookups in flight per region in scan mode
+SCAN_FIELDS = ("region", "asg_name", "template_name", "version", "image_id", "state", "vma_value")
 
 '''Objective: create an easy way to gather info for all ASG launch templates, and update them as well'''
 
-def get_asgs(client):
-  '''Return a list of all ASGs for a region'''
-  # 'describe_auto_scaling_groups',
-  groups = client.describe_auto_scaling_groups()['AutoScalingGroups']
+def get_asgs(client, on_page=None, limit=None):
+  '''Yield all ASGs (at most limit) for a region, streaming them as describe_auto_scaling_groups pages arrive'''
   print("*"*80)
-  print(f"Number of ASGs found: {len(groups)}")
-  for g in groups:
-    print(f"Name: {g['AutoScalingGroupName']}")
-  return groups
+  count = 0
+  for g in itertools.islice(iter_asgs(client, on_page=on_page), limit):
+    print(f"Name: {g.name}")
+    count += 1
+    yield g
+  print(f"Number of ASGs found: {count}")
 
 def describe_group(client, group_name):
     """
@@ -48,8 +62,7 @@ def get_lt_template(ec2_client, template_name):
   :return: The template, if it exists.
   """
   try:
-      response = ec2_client.describe_launch_templates(LaunchTemplateNames=[template_name])
-      template = response['LaunchTemplates'][0]
+      template = lt_catalog.catalog.template(ec2_client, template_name)
   except ClientError as err:
       if err.response['Error']['Code'] == 'InvalidLaunchTemplateName.NotFoundException':
           logger.warning("Launch template %s does not exist.", template_name)
@@ -62,89 +75,53 @@ def get_lt_template(ec2_client, template_name):
       return template
 
 def get_lt_info(ec2_client, template_name):
-  response = ec2_client.describe_launch_template_versions(
-    LaunchTemplateName=template_name,
-    Versions=[
-        '$Default',
-    ]
-  )
-  return response
+  '''$Default version of a launch template as a records.LaunchTemplateVersion, served from the launch template catalogue'''
+  return lt_catalog.catalog.version(ec2_client, template_name, '$Default')
+
+def prefetch_page(ec2_client, page):
+  '''Batch-load the $Default launch template versions and AMIs a page of ASGs uses'''
+  refs = [(asg.template_name, '$Default') for asg in page if asg.template_name]
+  try:
+    lt_catalog.catalog.prefetch(ec2_client, refs)
+    ami_cache.resolver.prefetch(ec2_client, lt_catalog.catalog.image_ids(ec2_client, refs))
+  except ClientError as err:
+    logger.warning("Prefetch failed, continuing without it: %s", err)
 
-def get_ami_id(response):
+def get_ami_id(lt):
   '''Return just hte ImageID for the AMI'''
-  return response['LaunchTemplateVersions'][0]['LaunchTemplateData']['ImageId']
+  return lt.image_id
 
-def get_lt_name(response):
+def get_lt_name(lt):
   '''Return the template name'''
-  return response['LaunchTemplateVersions'][0]['LaunchTemplateData']['ImageId']
+  return lt.template_name
 
-def get_launch_template_version(response):
-  '''Return just hte ImageID for the AMI'''
-  return response['LaunchTemplateVersions'][0]['VersionNumber']
+def get_launch_template_version(lt):
+  '''Return just the version number'''
+  return lt.version_number
 
-def determine_if_VMA_tag_exists(response):
+def determine_if_VMA_tag_exists(lt):
   '''Return True/False'''
-  result = False
-  lt_template_data = response['LaunchTemplateVersions'][0]['LaunchTemplateData']
-  # Handle the case of no tags set at all
-  if 'TagSpecifications' not in lt_template_data.keys():
-    print("TagSpeicifcations not found in LaunchTemplateData")
-    return False
-  else:
-    # Handle the case tag is missing
-    tags_by_type = lt_template_data.get('TagSpecifications', None)
-    for tag_type in tags_by_type:
-      if tag_type.get('ResourceType') == "instance": # Found all the instance tags
-        instance_tags_list = tag_type.get('Tags')
-        for dict in instance_tags_list:
-          print(f"tag_dict: {dict}")
-          if dict['Key'] == 'Vendor_Managed_AMI':
-            return True
-  return result
-
-def create_instance_tags_list(response, VMA_value):
-  '''Inspect a response, and return the correct TagSpecifications when adding our Vendor_Managed_AMI tag'''
-  TagSpecifications = []
-  lt_template_data = response['LaunchTemplateVersions'][0]['LaunchTemplateData']
-  if 'TagSpecifications' not in lt_template_data.keys(): # no tags on any resource types at all
-    TagSpecifications.append({'ResourceType': 'instance',
-                               'Tags' : [ {'Key': 'Vendor_Managed_AMI', 'Value': VMA_value}]})
-  else: # we preserve existing tags, and add ours to it
-    tags_list = lt_template_data.get('TagSpecifications', None) # tags_list is a list of dicts
-    for tags_dict in tags_list:
-      if tags_dict.get('ResourceType') != "instance": # keep other types intact
-        TagSpecifications.append(tags_dict)
-      else: # we need to add our key/value and preserve the other instance tags
-        new_tags_dict = {'ResourceType' : 'instance'}
-        new_tags = tags_dict['Tags'][:] # get a copy, preserves all the current tags
-        new_tags.append( {'Key':'Vendor_Managed_AMI', 'Value': VMA_value})
-        new_tags_dict['Tags'] = new_tags
-    TagSpecifications.append(new_tags_dict)
-  return TagSpecifications 
+  return lt.has_tag(lt_tags.VMA_KEY)
 
+def create_instance_tags_list(lt, VMA_value):
+  '''Inspect a launch template version, and return the correct TagSpecifications when adding our Vendor_Managed_AMI tag'''
+  return lt_tags.with_tag(lt.lt_data, VMA_value)
 
 def get_ami_info(ec2_client, ami_id):
-  '''Looks up and returns ami_name, owner, location'''
-  image_info = ec2_client.describe_images(ImageIds=[ami_id])
-  image_location = "none"
-  ami_name = "none"
-  owner_id = "none"
-  if len(image_info['Images']) > 0:
-    image = image_info['Images'][0]
-    image_location = image['ImageLocation']
-    ami_name = image['Name']
-    owner_id = image['OwnerId']
-  return image_location, ami_name, owner_id
-
-def get_vendor_tag_value(image_location, ami_name, owner_id):
-  '''fill out with logic later on - returns true, false, tbd'''
-  return "true"
+  '''Looks up and returns location, ami_name, owner - served from the shared AMI cache'''
+  return ami_cache.resolver.get(ec2_client, ami_id)
+
+def get_vendor_tag_value(image_location, ami_name, owner_id, ami_id=None):
+  '''Classify the AMI against vendor_rules.json - returns true, false, tbd'''
+  return vendor_rules.classify(image_location, ami_name, owner_id, ami_id)
 
 def create_new_launch_template(ec2_client, lt_name, lt_version, lt_dict):
   '''Create a new launch template, simply updating it with our new tag dictionary'''
+  # the token makes a retried request return the version the first attempt created
   response = ec2_client.create_launch_template_version(LaunchTemplateName=lt_name,
                                             SourceVersion=lt_version,
-                                            LaunchTemplateData=lt_dict)
+                                            LaunchTemplateData=lt_dict,
+                                            ClientToken=lt_catalog.client_token(lt_name, lt_version, lt_dict))
   return response
 
 def update_launch_template(template_name, tag_value):
@@ -152,84 +129,197 @@ def update_launch_template(template_name, tag_value):
   # modify_launch_template()
   pass
 
+def analyze_region(region, dry_run, limit=None):
+  '''Inspect (and unless dry_run, tag) every ASG launch template in one region, at most limit ASGs'''
+  print("-"*80)
+  print("-"*80)
+  print(f"NOW IN REGION: {region}")
+  ec2_client, asg_client = get_region_clients(region)
+  asgs = get_asgs(asg_client, on_page=lambda page: prefetch_page(ec2_client, page), limit=limit)
+  #pprint.pprint(asgs)  
+  for asg in asgs:
+    aws_metrics.recorder.add_asgs(1)
+    template_name = asg.template_name
+    if not template_name:
+      print(f"ASG {asg.name} does not use a launch template, SKIPPING this ASG")
+      continue
+    print("*" * 80)
+    print(f"Template Name: {template_name}")
+    print("*" * 80)
+    lt = get_lt_template(ec2_client, template_name)
+    print("-"*80)
+    if lt:
+      print(f"Default version: {lt['DefaultVersionNumber']}, latest version: {lt['LatestVersionNumber']}")
+    response = get_lt_info(ec2_client, template_name)
+    print("*" * 80)
+    print("LAUNCH TEMPLATE INFO")
+    pprint.pprint(response.lt_data)
+    print("*" * 80)
+    # Check if tag for Vendor_Managed_AMI already exists, if so then skip this one
+    VMA_tag_exists = determine_if_VMA_tag_exists(response)
+    if VMA_tag_exists:
+      print("Vendor_Managed_AMI tag exists, SKIPPING this ASG")
+      continue
+    else:
+      print("VMA tag does not exist, will CREATE this tag")
+    print("*" * 80)
+    ami_id = get_ami_id(response)
+    lt_version = get_launch_template_version(response)
+    print("*" * 80)
+    print(f"AMI ImageID: {ami_id}") 
+    print(f"launch template version: {lt_version}") 
+    image_location, ami_name, owner_id = get_ami_info(ec2_client, ami_id)
+    print("*" * 80)
+    print(f"image_location: {image_location}")
+    print(f"ami_name: {ami_name}")
+    print(f"owner_id: {owner_id}")
+    tag_value = get_vendor_tag_value(image_location, ami_name, owner_id, ami_id)
+    print("*" * 80)
+    print(f"Vendor_Managed_AMI tag value will be: {tag_value}")
+    print("*" * 80)  
+    TagSpecifications = create_instance_tags_list(response, tag_value)
+    if not dry_run: 
+      lt_dict = {'TagSpecifications': TagSpecifications}
+      new_lt = create_new_launch_template(ec2_client, template_name, str(lt_version), lt_dict)
+      new_lt_version = new_lt['LaunchTemplateVersion']['VersionNumber']
+      lt_catalog.catalog.note_new_version(ec2_client, template_name, new_lt_version)
+      print("*" * 80)
+      print(f"New launch template version: {new_lt_version}")
+      print("*" * 80)
+      print(f"Updating launch template to use new version {new_lt_version} as default version")
+      version_update_response = ec2_client.modify_launch_template(
+        DryRun=False,
+        #ClientToken='string',
+        #LaunchTemplateId='string',
+        LaunchTemplateName=template_name,
+        DefaultVersion=str(new_lt_version)
+        )
+      lt_catalog.catalog.note_default_version(ec2_client, template_name, new_lt_version)
+
+    else:
+      print()
+      print("*" * 80)
+      print("*" * 80)
+      print("Dry run enabled: skipping creation of new launch template, update of tags, switching asg to use new launch template")
+      print("*" * 80)
+      print("Current TagSpecifications are: ")
+      pprint.pprint(TagSpecifications)
+
+async def scan_lookups(lookup, ec2_client, asg):
+  '''Read-only analysis of one ASG for scan mode, returns its SCAN_FIELDS values after region.
+
+  The template description and the $Default version only need the template
+  name, so both are requested at once; the AMI lookup waits for the version's ImageId.
+  '''
+  template_name = asg.template_name
+  if not template_name:
+    return asg.name, "", "", "", "no-launch-template", ""
+  try:
+    template, lt = await asyncio.gather(lookup(get_lt_template, ec2_client, template_name),
+                                        lookup(get_lt_info, ec2_client, template_name), return_exceptions=True)
+    if template is None: # whatever the version lookup raised, the template is missing
+      return asg.name, template_name, "", "", "template-not-found", ""
+    for result in (template, lt):
+      if isinstance(result, Exception):
+        raise result
+    if determine_if_VMA_tag_exists(lt):
+      return asg.name, template_name, lt.version_number, lt.image_id, "tagged", ""
+    image_location, ami_name, owner_id = await lookup(get_ami_info, ec2_client, lt.image_id)
+  except ClientError as err: # one unreadable template must not end the audit
+    code = err.response['Error']['Code']
+    state = "template-not-found" if code == lt_catalog.NOT_FOUND_CODE else f"error:{code}"
+    return asg.name, template_name, "", "", state, ""
+  except BotoCoreError as err: # e.g. endpoint unreachable or read timeouts after the governor gave up
+    return asg.name, template_name, "", "", f"error:{type(err).__name__}", ""
+  return (asg.name, template_name, lt.version_number, lt.image_id, "untagged",
+          get_vendor_tag_value(image_location, ami_name, owner_id, lt.image_id))
+
+async def scan_region(region, concurrency=SCAN_CONCURRENCY, limit=None, out=None):
+  '''Read-only single pass over one region's ASGs, writing one SCAN_FIELDS line per ASG as it finishes.
+
+  Blocking boto3 calls run on a thread pool, at most concurrency of them at a
+  time, and each distinct lookup runs once - ASGs sharing a template or AMI
+  await the same task. Up to 2x concurrency ASGs are in flight, so lines come
+  out in completion order and memory stays flat however large the region is.
+  Returns a Counter of states.
+  '''
+  out = out or sys.stdout
+  loop = asyncio.get_running_loop()
+  ec2_client, asg_client = get_region_clients(region, max(MAX_POOL_CONNECTIONS, concurrency))
+  semaphore = asyncio.Semaphore(concurrency)
+  states = collections.Counter()
+  tasks = {} # (lookup function, args) -> asyncio task
+
+  async def call(fn, *args):
+    async with semaphore:
+      return await loop.run_in_executor(executor, fn, *args)
+
+  def lookup(fn, *args):
+    task = tasks.get((fn,) + args)
+    if task is None:
+      task = tasks[(fn,) + args] = asyncio.ensure_future(call(fn, *args))
+    return task
+
+  def report(done):
+    for task in done:
+      fields = (region,) + task.result()
+      states[fields[5]] += 1
+      out.write(",".join(map(str, fields)) + "\n")
+    aws_metrics.recorder.add_asgs(len(done))
+
+  # templates are described a page at a time, which resolves $Default for every version lookup;
+  # the versions and AMIs themselves are fetched concurrently below rather than page by page
+  asgs = iter_asgs(asg_client, on_page=lambda page: lt_catalog.catalog.prefetch_templates(
+    ec2_client, {asg.template_name for asg in page if asg.template_name}))
+  if limit is not None:
+    asgs = itertools.islice(asgs, limit)
+  # one thread more than the semaphore allows, so reading the inventory never queues behind lookups
+  with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency + 1, thread_name_prefix=f"scan-{region}") as executor:
+    pending = set()
+    while True:
+      page = await loop.run_in_executor(executor, lambda: list(itertools.islice(asgs, PAGE_SIZE)))
+      if not page:
+        break
+      for asg in page:
+        while len(pending) >= concurrency * 2:
+          done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+          report(done)
+        pending.add(asyncio.ensure_future(scan_lookups(lookup, ec2_client, asg)))
+    while pending:
+      done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+      report(done)
+  return states
+
+async def scan_regions(regions, concurrency=SCAN_CONCURRENCY, limit=None):
+  '''scan_region for every region at once'''
+  print(",".join(SCAN_FIELDS))
+  return await asyncio.gather(*(scan_region(region, concurrency, limit) for region in regions))
+
+def scan(concurrency=SCAN_CONCURRENCY, limit=None):
+  '''Fast read-only audit: one pass per region, a compact line per ASG, then a summary'''
+  start = time.perf_counter()
+  results = asyncio.run(scan_regions(REGIONS, concurrency, limit))
+  for region, states in zip(REGIONS, results):
+    print(f"{region}: {sum(states.values())} ASGs - " + ", ".join(f"{k} {v}" for k, v in sorted(states.items())))
+  print(f"Scanned in {time.perf_counter() - start:.1f}s")
+  print(aws_metrics.recorder.report())
+  aws_metrics.recorder.write(METRICS)
+
 def main(dry_run, count):
-  while count > 0:
-    for region in REGIONS:
-      print("-"*80)
-      print("-"*80)
-      print(f"NOW IN REGION: {region}")
-      ec2_client = boto3.client('ec2', region_name=region)
-      asg_client = boto3.client('autoscaling', region_name=region)
-      asgs = get_asgs(asg_client)
-      #pprint.pprint(asgs)  
-      for asg in asgs:
-        template_name = asg['LaunchTemplate']['LaunchTemplateName']
-        print("*" * 80)
-        print(f"Template Name: {template_name}")
-        print("*" * 80)
-        lt = get_lt_template(ec2_client, template_name)
-        print("-"*80)
-        pprint.pprint(lt)
-        response = get_lt_info(ec2_client, template_name)
-        print("*" * 80)
-        print("LAUNCH TEMPLATE INFO")
-        pprint.pprint(response)
-        print("*" * 80)
-        # Check if tag for Vendor_Managed_AMI already exists, if so then skip this one
-        VMA_tag_exists = determine_if_VMA_tag_exists(response)
-        if VMA_tag_exists:
-          print("Vendor_Managed_AMI tag exists, SKIPPING this ASG")
-          continue
-        else:
-          print("VMA tag does not exist, will CREATE this tag")
-        print("*" * 80)
-        ami_id = get_ami_id(response)
-        lt_version = get_launch_template_version(response)
-        print("*" * 80)
-        print(f"AMI ImageID: {ami_id}") 
-        print(f"launch template version: {lt_version}") 
-        image_location, ami_name, owner_id = get_ami_info(ec2_client, ami_id)
-        print("*" * 80)
-        print(f"image_location: {image_location}")
-        print(f"ami_name: {ami_name}")
-        print(f"owner_id: {owner_id}")
-        tag_value = get_vendor_tag_value(image_location, ami_name, owner_id)
-        print("*" * 80)
-        print(f"Vendor_Managed_AMI tag value will be: {tag_value}")
-        print("*" * 80)  
-        VMA_tag_exists_str = str(VMA_tag_exists).lower()   
-        TagSpecifications = create_instance_tags_list(response, VMA_tag_exists_str)   
-        if not dry_run: 
-          lt_dict = {'TagSpecifications': TagSpecifications}
-          new_lt = create_new_launch_template(ec2_client, template_name, str(lt_version), lt_dict)
-          new_lt_version = new_lt['LaunchTemplateVersion']['VersionNumber']
-          print("*" * 80)
-          print(f"New launch template version: {new_lt_version}")
-          print("*" * 80)
-          print(f"Updating launch template to use new version {new_lt_version} as default version")
-          version_update_response = ec2_client.modify_launch_template(
-            DryRun=False,
-            #ClientToken='string',
-            #LaunchTemplateId='string',
-            LaunchTemplateName=template_name,
-            DefaultVersion=str(new_lt_version)
-            )
-
-        else:
-          print()
-          print("*" * 80)
-          print("*" * 80)
-          print("Dry run enabled: skipping creation of new launch template, update of tags, switching asg to use new launch template")
-          print("*" * 80)
-          print("Current TagSpecifications are: ")
-          pprint.pprint(TagSpecifications)
-    count = count - 1
+  run_regions(analyze_region, REGIONS, dry_run, count) # every region at the same time, one pass each
+  print(aws_metrics.recorder.report())
+  aws_metrics.recorder.write(METRICS)
     
 
 
 if __name__ == "__main__":
   dry_run = True
   count = 1000 # far more asgs than we expect = "no limit"
+  if len(sys.argv) > 1 and sys.argv[1].lower() == "scan":
+    # analyze_ami_tags.py scan [concurrency [count]] - read-only, asyncio driven
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else SCAN_CONCURRENCY
+    scan(concurrency, int(sys.argv[3]) if len(sys.argv) > 3 else None)
+    sys.exit(0)
   if len(sys.argv) > 1:
     input = sys.argv[1]
     if "false" == input.lower():
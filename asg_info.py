@@ -1,17 +1,39 @@
 #!/usr/bin/env python3
-import boto3
 import sys
 import pprint
 import logging
 from botocore.exceptions import ClientError
 import argparse
 import datetime
+import threading
+import collections
+import itertools
+import concurrent.futures
+import shutil
+import tempfile
+import json
+import hashlib
+import ami_cache
+import lt_catalog
+import lt_tags
+import checkpoint
+import aws_metrics
+import vendor_rules
+from asg_inventory import iter_asgs
+from aws_regions import MAX_POOL_CONNECTIONS, get_region_clients, run_regions
 
 logger = logging.getLogger(__name__)
 
 REGIONS = ["us-west-2"]
 FILENAME = "asgs_using_launch_config.txt"
 HISTORY = "asg-update-output"
+CHECKPOINT = "asg-update-checkpoint.sqlite"
+PLAN = "asg-update-plan"
+METRICS = "asg-update-metrics"
+PREFETCH_LOOKUPS = True # batch-load each inventory page's launch templates and AMIs ahead of the workers
+LAUNCH_CONFIGURATION = "launch-configuration" # fingerprint marker for ASGs that are skipped
+
+_launch_config_file_lock = threading.Lock()
 
 
 def write_launch_config_asg_file(region, asg_name):
@@ -23,92 +45,56 @@ def write_launch_config_asg_file(region, asg_name):
 def get_asgs(client, asg_name=None):
     '''Return a list of either one, or all ASGs for a region'''
     if asg_name:
-        groups = client.describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name])['AutoScalingGroups']
+        groups = list(iter_asgs(client, [asg_name], prefetch=0))
         if len(groups) == 0:
             print("ASG not found, exiting")
             sys.exit(1)
     else:
-        groups = client.describe_auto_scaling_groups()['AutoScalingGroups']
+        groups = list(iter_asgs(client))
     return groups
 
 def get_launch_template_version(asg):
     version = "Not using launch template"
-    lt = asg.get('LaunchTemplate', None)
-    if lt:
-        version = lt.get('Version', None)
+    if asg.template_name:
+        version = asg.template_version
     return version
 
 def get_lt_info(ec2_client, template_name, version):
-  response = ec2_client.describe_launch_template_versions(
-    LaunchTemplateName=template_name,
-    Versions=[
-        version,
-    ]
-  )
-  return response
+  '''records.LaunchTemplateVersion for one version, served from the launch template catalogue'''
+  return lt_catalog.catalog.version(ec2_client, template_name, version)
 
-def determine_if_VMA_tag_exists(response):
-  '''Return True/False'''
-  result = False
-  lt_template_data = response['LaunchTemplateVersions'][0]['LaunchTemplateData']
-  # Handle the case of no tags set at all
-  if 'TagSpecifications' not in lt_template_data.keys():
-    #print("TagSpeicifcations not found in LaunchTemplateData")
-    return False
-  else:
-    # Handle the case tag is missing
-    tags_by_type = lt_template_data.get('TagSpecifications', None)
-    for tag_type in tags_by_type:
-      if tag_type.get('ResourceType') == "instance": # Found all the instance tags
-        instance_tags_list = tag_type.get('Tags')
-        for dict in instance_tags_list:
-          #print(f"tag_dict: {dict}")
-          if dict['Key'] == 'Vendor_Managed_AMI':
-            return True
-  return result
+def prefetch_page(ec2_client, page):
+  '''Batch-load the launch templates and AMIs a page of ASGs uses before the page is processed'''
+  refs = [(asg.template_name, asg.template_version) for asg in page if asg.template_name]
+  try:
+    lt_catalog.catalog.prefetch(ec2_client, refs)
+    ami_cache.resolver.prefetch(ec2_client, lt_catalog.catalog.image_ids(ec2_client, refs))
+  except ClientError as err: # only an optimisation - per-ASG lookups fetch whatever is missing
+    logger.warning("Prefetch failed, continuing without it: %s", err)
+
+def determine_if_VMA_tag_exists(lt):
+  '''Return True/False for a records.LaunchTemplateVersion'''
+  return lt.has_tag(lt_tags.VMA_KEY)
 
 def get_ami_info(ec2_client, ami_id):
-  '''Looks up and returns ami_name, owner, location'''
-  image_info = ec2_client.describe_images(ImageIds=[ami_id])
-  image_location = "none"
-  ami_name = "none"
-  owner_id = "none"
-  if len(image_info['Images']) > 0:
-    image = image_info['Images'][0]
-    image_location = image['ImageLocation']
-    ami_name = image['Name']
-    owner_id = image['OwnerId']
-  return image_location, ami_name, owner_id
-
-def get_vendor_tag_value(image_location, ami_name, owner_id):
-  '''fill out with logic later on - returns true, false, tbd'''
-  return "true"
-
-def create_instance_tags_list(response, VMA_value):
-  '''Inspect a response, and return the correct TagSpecifications when adding our Vendor_Managed_AMI tag'''
-  TagSpecifications = []
-  lt_template_data = response['LaunchTemplateVersions'][0]['LaunchTemplateData']
-  if 'TagSpecifications' not in lt_template_data.keys(): # no tags on any resource types at all
-    TagSpecifications.append({'ResourceType': 'instance',
-                               'Tags' : [ {'Key': 'Vendor_Managed_AMI', 'Value': VMA_value}]})
-  else: # we preserve existing tags, and add ours to it
-    tags_list = lt_template_data.get('TagSpecifications', None) # tags_list is a list of dicts
-    for tags_dict in tags_list:
-      if tags_dict.get('ResourceType') != "instance": # keep other types intact
-        TagSpecifications.append(tags_dict)
-      else: # we need to add our key/value and preserve the other instance tags
-        new_tags_dict = {'ResourceType' : 'instance'}
-        new_tags = tags_dict['Tags'][:] # get a copy, preserves all the current tags
-        new_tags.append( {'Key':'Vendor_Managed_AMI', 'Value': VMA_value})
-        new_tags_dict['Tags'] = new_tags
-    TagSpecifications.append(new_tags_dict)
-  return TagSpecifications 
+  '''Looks up and returns location, ami_name, owner - served from the shared AMI cache'''
+  return ami_cache.resolver.get(ec2_client, ami_id)
+
+def get_vendor_tag_value(image_location, ami_name, owner_id, ami_id=None):
+  '''Classify the AMI against vendor_rules.json - returns true, false, tbd'''
+  return vendor_rules.classify(image_location, ami_name, owner_id, ami_id)
+
+def create_instance_tags_list(lt, VMA_value):
+  '''Inspect a launch template version, and return the correct TagSpecifications when adding our Vendor_Managed_AMI tag'''
+  return lt_tags.with_tag(lt.lt_data, VMA_value)
 
 def create_new_launch_template(ec2_client, lt_name, lt_version, lt_dict):
   '''Create a new launch template, simply updating it with our new tag dictionary'''
+  # the token makes a retried request return the version the first attempt created
   response = ec2_client.create_launch_template_version(LaunchTemplateName=lt_name,
                                             SourceVersion=lt_version,
-                                            LaunchTemplateData=lt_dict)
+                                            LaunchTemplateData=lt_dict,
+                                            ClientToken=lt_catalog.client_token(lt_name, lt_version, lt_dict))
   return response
 
 def update_asg_launch_template_version(asg_client, asg_name, template_name, template_version):
@@ -132,145 +118,417 @@ def update_launch_template_default(ec2_client, template_name, new_lt_version):
         )
     return version_update_response
 
-def main(dry_run=True, num_asg=None, asg_name=None, region=None):
-    ec2_client = boto3.client('ec2', region_name=region)
-    asg_client = boto3.client('autoscaling', region_name=region)
-    asgs = get_asgs(asg_client)
-    asg_count = len(asgs)
+class TemplateRegistry:
+    '''Per-region bookkeeping shared by workers: one lock per launch template, the tagged
+    version created for each (template, source version), and the checkpoint journal'''
+    def __init__(self, region=None, journal=None):
+        self._guard = threading.Lock()
+        self._locks = {}
+        self.region = region
+        self.journal = journal
+        # versions created by an interrupted earlier run are reused, never created twice
+        self.created = journal.created_versions(region) if journal else {}
+        self.defaults = {} # template -> version this run made $Default
 
-    now = datetime.datetime.now()
-    fname = "-".join([HISTORY, str(now.year), str(now.month), str(now.day), str(now.hour), str(now.minute), str(now.second)]) + ".csv"
-    history = open(fname, 'w')
-    history.write("Region,ASG Name,LT Name,Updated,Detail")
+    def record(self, asg_name, state, **details):
+        if self.journal:
+            self.journal.record(self.region, asg_name, state, **details)
+
+    def lock_for(self, template_name):
+        with self._guard:
+            return self._locks.setdefault(template_name, threading.Lock())
+
+    def remember(self, asg_name, template_name, version, resolved=None, image_id=None):
+        '''Save the fingerprint of the state this run left the ASG in, for --incremental'''
+        if self.journal:
+            self.journal.save_fingerprint(self.region, asg_name, asg_fingerprint(template_name, version, resolved, image_id), image_id)
+
+class ProposedVersions:
+    '''Version numbers a dry run proposes: one per (template, source version), in the order entries are
+    assigned, starting after the template's $Latest - just as the update path creates them'''
+    def __init__(self, ec2_client, region):
+        self.ec2_client = ec2_client
+        self.region = region
+        self._proposed = {} # (template, source version) -> proposed version number
+        self._next = {} # template -> next free version number
+
+    def latest(self, template_name):
+        # describes the template on a miss, so $Latest is known even when page prefetch is off or failed
+        if lt_catalog.catalog.template(self.ec2_client, template_name) is None:
+            raise ValueError(f"Launch template {template_name} not found in {self.region}")
+        return lt_catalog.catalog.resolve(self.region, template_name, '$Latest')
+
+    def assign(self, entry):
+        '''Set proposed_version on a 'tag' plan entry; returns the entry'''
+        if entry['action'] == 'tag':
+            key = (entry['template_name'], entry['source_version'])
+            if key not in self._proposed:
+                self._proposed[key] = max(self.latest(key[0]) + 1, self._next.get(key[0], 0))
+                self._next[key[0]] = self._proposed[key] + 1
+            entry['proposed_version'] = self._proposed[key]
+        return entry
+
+def asg_fingerprint(template_name, version, resolved=None, image_id=None):
+    '''Hash of what decides an ASG's work: launch template name and version as the ASG names them,
+    the version number that resolves to, and its AMI'''
+    return hashlib.sha1("|".join(map(str, (template_name, version, resolved, image_id))).encode()).hexdigest()
+
+def asg_unchanged(region, asg, known):
+    '''True when asg still matches the fingerprint an earlier run saved in known.
+    Template versions never change, so the same resolved version means the same AMI.'''
+    previous = known.get(asg.name)
+    if previous is None:
+        return False
+    fingerprint, image_id = previous
+    if asg.launch_configuration:
+        return fingerprint == asg_fingerprint(LAUNCH_CONFIGURATION, asg.launch_configuration)
+    if not asg.template_name:
+        return False
+    resolved = lt_catalog.catalog.resolve(region, asg.template_name, asg.template_version)
+    return resolved is not None and fingerprint == asg_fingerprint(asg.template_name, asg.template_version, resolved, image_id)
+
+def write_history_row(history, region, result):
+    asg_name, template_name, updated, detail = result
+    history.write(",".join([str(region), str(asg_name), str(template_name), str(updated), str(detail)]))
     history.write("\n")
 
-    # Update one asg only - for testing purposes, assuming us-west-2 region
-    if asg_name:  
-        # get an asg, pass it to update_asg_tag fn
-        ec2_client = boto3.client('ec2', region_name=region)
-        asg_client = boto3.client('autoscaling', region_name=region)
-        asg_list = get_asgs(asg_client, asg_name) # should have 1 element
-        asg_name, template_name, updated, detail = update_asg_tag(ec2_client, asg_client, region, asg_list[0])
-        history.write(",".join([str(region), str(asg_name), str(template_name), str(updated), str(detail)]))
-        history.write("\n")
-    # Update only up to the value of num_asg - for batch testing purposes e.g. update 5 and review data
-    elif num_asg:
+def write_plan_entry(plan, entry):
+    plan.write(json.dumps(entry))
+    plan.write("\n")
+
+def timestamped_name(prefix, extension):
+    now = datetime.datetime.now()
+    return "-".join([prefix, str(now.year), str(now.month), str(now.day), str(now.hour), str(now.minute), str(now.second)]) + extension
+
+def map_ordered(fn, items, workers=1):
+    '''Yield fn(item) for every item, in input order, running up to workers calls at once.
+    At most 2x workers items are in flight so memory stays flat while streaming the inventory.'''
+    if workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+    pending = collections.deque() # futures in submission order
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            while pending and (len(pending) >= workers * 2 or pending[0].done()):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def process_asgs(ec2_client, asg_client, region, asgs, history, workers=1, registry=None):
+    '''Run update_asg_tag over an iterable of ASGs, returns the number processed.
+
+    With workers > 1 the ASGs are handled by a bounded thread pool; history rows are
+    still written in the order the ASGs were received.
+    '''
+    if registry is None:
+        registry = TemplateRegistry(region)
+    def update(asg):
+        registry.record(asg.name, checkpoint.PENDING)
+        return update_asg_tag(ec2_client, asg_client, region, asg, registry)
+    count = 0
+    for result in map_ordered(update, asgs, workers):
+        write_history_row(history, region, result)
+        count += 1
+    aws_metrics.recorder.add_asgs(count)
+    return count
+
+def region_asgs(region, ec2_client, asg_client, inventory_kwargs=None, limit=None, done=(), known=None, unchanged=None):
+    '''Stream a region's ASGs, leaving out those in done, prefetching templates and AMIs page by page.
+
+    With known ({asg_name: (fingerprint, image_id)} from an earlier run), each page's
+    templates are described in one batch to resolve $Default/$Latest, and ASGs whose
+    fingerprint still matches are added to unchanged and left out before any other lookup.
+    '''
+    if unchanged is None:
+        unchanged = set()
+    def on_page(page):
+        page = [asg for asg in page if asg.name not in done]
+        if known:
+            lt_catalog.catalog.prefetch_templates(ec2_client, {asg.template_name for asg in page if asg.template_name})
+            unchanged.update(asg.name for asg in page if asg_unchanged(region, asg, known))
+            page = [asg for asg in page if asg.name not in unchanged]
+        if PREFETCH_LOOKUPS:
+            prefetch_page(ec2_client, page)
+    asgs = (asg for asg in iter_asgs(asg_client, on_page=on_page if PREFETCH_LOOKUPS or known else None, **(inventory_kwargs or {}))
+            if asg.name not in done and asg.name not in unchanged)
+    if limit is not None:
+        # ASGs are streamed page by page, so stopping early never fetches the remaining pages
+        asgs = itertools.islice(asgs, limit)
+    return asgs
+
+def process_region(region, history, workers=1, inventory_kwargs=None, limit=None, journal=None, incremental=False):
+    '''Update every ASG in one region using that region's shared client pair.
+    ASGs the journal already has as finished are skipped without any lookups; with
+    incremental, so are ASGs unchanged since the fingerprints of an earlier run.'''
+    ec2_client, asg_client = get_region_clients(region, max(MAX_POOL_CONNECTIONS, workers))
+    done = journal.completed(region) if journal else set()
+    known = journal.fingerprints(region) if journal and incremental else None
+    unchanged = set()
+    asgs = region_asgs(region, ec2_client, asg_client, inventory_kwargs, limit, done, known, unchanged)
+    count = process_asgs(ec2_client, asg_client, region, asgs, history, workers, TemplateRegistry(region, journal))
+    if incremental:
+        print(f"{region}: {count} ASGs new or changed, {len(unchanged)} unchanged since the last run")
+    return count
+
+def plan_region(region, plan, workers=1, inventory_kwargs=None, limit=None, fingerprints=None):
+    '''Read-only pass over one region: write the plan entry for every ASG, returns the number planned.
+
+    Lookups run in parallel; proposed version numbers are assigned afterwards in
+    ASG order, one per (template, source version) just as the update path creates them.
+    '''
+    ec2_client, asg_client = get_region_clients(region, max(MAX_POOL_CONNECTIONS, workers))
+    known = fingerprints.fingerprints(region) if fingerprints else None
+    unchanged = set()
+    asgs = region_asgs(region, ec2_client, asg_client, inventory_kwargs, limit, known=known, unchanged=unchanged)
+    proposed = ProposedVersions(ec2_client, region)
+    count = 0
+    for entry in map_ordered(lambda asg: plan_asg_tag(ec2_client, region, asg), asgs, workers):
+        write_plan_entry(plan, proposed.assign(entry))
+        count += 1
+    aws_metrics.recorder.add_asgs(count)
+    if fingerprints:
+        print(f"{region}: {count} ASGs new or changed, {len(unchanged)} unchanged since the last run")
+    return count
+
+def apply_region(region, history, workers=1, plan_entries=None, limit=None, journal=None):
+    '''Write-only pass: carry out the plan entries for one region without describing anything'''
+    ec2_client, asg_client = get_region_clients(region, max(MAX_POOL_CONNECTIONS, workers))
+    registry = TemplateRegistry(region, journal)
+    done = journal.completed(region) if journal else set()
+    entries = (e for e in plan_entries[region] if e['asg_name'] not in done)
+    if limit is not None:
+        entries = itertools.islice(entries, limit)
+    def apply(entry):
+        registry.record(entry['asg_name'], checkpoint.PENDING)
+        with registry.lock_for(entry.get('template_name')):
+            return apply_plan_entry(ec2_client, asg_client, entry, registry)
+    count = 0
+    for result in map_ordered(apply, entries, workers):
+        write_history_row(history, region, result)
+        count += 1
+    aws_metrics.recorder.add_asgs(count)
+    return count
+
+def read_plan(plan_file):
+    '''{region: [plan entries]} from a JSON Lines plan written by a dry run'''
+    entries = collections.OrderedDict()
+    with open(plan_file) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entries.setdefault(entry['region'], []).append(entry)
+    return entries
+
+def spool_region(region, task, **kwargs):
+    '''Run task into a private temp file so regions can run side by side'''
+    spool = tempfile.TemporaryFile('w+')
+    task(region, spool, **kwargs)
+    spool.seek(0)
+    return spool
+
+def run_all_regions(task, out, regions, num_asg=None, **kwargs):
+    '''Run task(region, out, ...) for every region.
+
+    All regions run at the same time, each into its own spool that is appended to
+    out in regions order. When num_asg caps the total, regions are walked in order
+    instead so the limit always applies to the same ASGs.
+    '''
+    if num_asg:
         count = 0
-        stop = 0
-        for reg in REGIONS:
-            ec2_client = boto3.client('ec2', region_name=reg)
-            asg_client = boto3.client('autoscaling', region_name=reg)
-            asgs = get_asgs(asg_client)
-            asg_count = len(asgs)
-            if num_asg < asg_count: 
-                stop = num_asg
-            else: 
-                stop = asg_count
-            for asg in asgs:
-                asg_name, template_name, updated, detail = update_asg_tag(ec2_client, asg_client, region, asg)
-                history.write(",".join([str(region), str(asg_name), str(template_name), str(updated), str(detail)]))
-                history.write("\n")
-                count = count + 1
-                if count >= stop:
-                    #print(f"Count: {count}")
-                    sys.exit(0) # Exit early b/c we are at the batch size limit
-    # Update all the ASGs in all regions
+        for reg in regions:
+            count += task(reg, out, limit=num_asg - count, **kwargs)
+            if count >= num_asg:
+                break # Exit early b/c we are at the batch size limit
+    else:
+        for spool in run_regions(spool_region, regions, task, **kwargs):
+            shutil.copyfileobj(spool, out)
+            spool.close()
+
+def main(dry_run=True, num_asg=None, asg_name=None, region=None, page_size=None, workers=1, ami_cache_file=None, ami_cache_ttl=ami_cache.DEFAULT_TTL,
+         checkpoint_file=CHECKPOINT, resume=False, plan_file=None, apply_plan=None, metrics_prefix=None, tag_index_file=None,
+         incremental=False):
+    '''dry_run writes a JSON Lines plan and makes no changes; apply_plan carries out such a plan
+    without repeating the reads; otherwise ASGs are read and updated in one pass.
+    incremental leaves out ASGs whose fingerprint in checkpoint_file matches their current state.'''
+    inventory_kwargs = {'page_size': page_size} if page_size else {}
+    if ami_cache_file: # skip describe_images for AMIs seen on a recent run
+        ami_cache.resolver.load(ami_cache_file, ami_cache_ttl)
+
+    if dry_run and not apply_plan:
+        plan_file = plan_file or timestamped_name(PLAN, ".jsonl")
+        plan = open(plan_file, 'w')
+        if asg_name:
+            ec2_client, asg_client = get_region_clients(region)
+            asg_list = get_asgs(asg_client, asg_name) # should have 1 element
+            prefetch_page(ec2_client, asg_list)
+            write_plan_entry(plan, ProposedVersions(ec2_client, region).assign(plan_asg_tag(ec2_client, region, asg_list[0])))
+            aws_metrics.recorder.add_asgs(1)
+        else:
+            fingerprints = checkpoint.Checkpoint(checkpoint_file, resume=True) if incremental else None
+            run_all_regions(plan_region, plan, REGIONS, num_asg, workers=workers, inventory_kwargs=inventory_kwargs,
+                            fingerprints=fingerprints)
+            if fingerprints:
+                fingerprints.close()
+        plan.close()
+        print(f"Dry run - no changes made, plan written to {plan_file}")
     else:
-        for reg in REGIONS:
-            ec2_client = boto3.client('ec2', region_name=reg)
-            asg_client = boto3.client('autoscaling', region_name=reg)
-            asgs = get_asgs(asg_client)    
-            for asg in asgs:
-                asg_name, template_name, updated, detail =  update_asg_tag(ec2_client, asg_client, region, asg)
-                history.write(",".join([str(region), str(asg_name), str(template_name), str(updated), str(detail)]))
-                history.write("\n")
-    history.close()
-
-def update_asg_tag(ec2_client=None, asg_client=None, region=None, asg=None):
+        history = open(timestamped_name(HISTORY, ".csv"), 'w')
+        history.write("Region,ASG Name,LT Name,Updated,Detail")
+        history.write("\n")
+        journal = checkpoint.Checkpoint(checkpoint_file, resume)
+
+        if apply_plan: # writes only, straight from a dry run's plan
+            plan_entries = read_plan(apply_plan)
+            run_all_regions(apply_region, history, list(plan_entries), num_asg, workers=workers,
+                            plan_entries=plan_entries, journal=journal)
+        # Update one asg only - for testing purposes, assuming us-west-2 region
+        elif asg_name:  
+            # get an asg, pass it to update_asg_tag fn
+            ec2_client, asg_client = get_region_clients(region)
+            asg_list = get_asgs(asg_client, asg_name) # should have 1 element
+            write_history_row(history, region, update_asg_tag(ec2_client, asg_client, region, asg_list[0], TemplateRegistry(region, journal)))
+            aws_metrics.recorder.add_asgs(1)
+        # Update only up to the value of num_asg - for batch testing purposes e.g. update 5 and review data,
+        # otherwise update all the ASGs in all regions
+        else:
+            run_all_regions(process_region, history, REGIONS, num_asg, workers=workers,
+                            inventory_kwargs=inventory_kwargs, journal=journal, incremental=incremental)
+        history.close()
+        print(f"Checkpoint {checkpoint_file}: {journal.counts()}")
+        journal.close()
+    if ami_cache_file:
+        ami_cache.resolver.save()
+    if tag_index_file: # every launch template version the run read, for lt_tags.py reports
+        index = lt_tags.TagIndex.from_catalog(lt_catalog.catalog)
+        print(f"Tag index of {len(index.versions)} launch template versions written to {index.save(tag_index_file)}")
+    print(aws_metrics.recorder.report())
+    metrics_files = aws_metrics.recorder.write(metrics_prefix or timestamped_name(METRICS, ""))
+    print(f"API metrics written to {', '.join(metrics_files)}")
+
+def update_asg_tag(ec2_client=None, asg_client=None, region=None, asg=None, registry=None):
     '''Update an asg launch template tag for Vendor_Managed_AMI'''
     # returns asg_name, lt_name, updated (bool)
-    #print("-"*80)
-    #print("-"*80)
-    #pprint.pprint(asg)
-    asg_name = asg['AutoScalingGroupName']
-
-    if 'LaunchConfigurationName' in asg.keys():
-        try:
-            region = asg['AvailabilityZones'][0][:-1]
-        except Exception as e:
-            region = "unknown"
-            pass
-
-        write_launch_config_asg_file(region, asg_name)
-        return asg_name, "None", False, "Uses Launch Configuration"
+    if registry is None:
+        registry = TemplateRegistry(region)
+    template_name = asg.template_name
+    # ASGs sharing a launch template are handled one at a time so a source version is only ever copied once
+    with registry.lock_for(template_name):
+        entry = plan_asg_tag(ec2_client, region, asg)
+        return apply_plan_entry(ec2_client, asg_client, entry, registry)
+
+def plan_asg_tag(ec2_client, region, asg):
+    '''Read-only half of update_asg_tag: describe what would be written for one ASG as a plan entry'''
+    asg_name = asg.name
+    entry = {'region': region, 'asg_name': asg_name}
+
+    if asg.launch_configuration:
+        entry.update(action='skip', detail="Uses Launch Configuration", launch_configuration=asg.launch_configuration)
+        return entry
     
     # ASG using launch template, gathering info
-    template_name = asg['LaunchTemplate']['LaunchTemplateName']
-    template_version = asg['LaunchTemplate']['Version']
-    #print("-"*80)
-    #print(f"asg template_version to use: {template_version}")
-    #print("-"*80)
+    template_name = asg.template_name
+    template_version = asg.template_version
     lt_info = get_lt_info(ec2_client, template_name, template_version)
-    image_id = lt_info['LaunchTemplateVersions'][0]['LaunchTemplateData']['ImageId']
-    lt_version = str(lt_info['LaunchTemplateVersions'][0]['VersionNumber'])
-    #print("-"*80)
-    #print(f"lt_version: {lt_version}")
-    #print("-"*80)
-    #print("Launch Template Info")
-    #pprint.pprint(lt_info)
-    #print("-"*80)
-    #print(f"ImageID: {image_id}")
-    #print("-"*80)
+    image_id = lt_info.image_id
+    lt_version = str(lt_info.version_number)
+    entry.update(template_name=template_name, template_version=template_version,
+                 source_version=lt_version, image_id=image_id)
     vma_exists = determine_if_VMA_tag_exists(lt_info)
-    #print(f"VMA tag exists: {vma_exists}")
     if vma_exists: # don't need to add a tag
-        print(f"ASG: {asg_name}, Launch Template {template_name}, already has tag 'Vendor_Managed_AMI' - will not update tags")
-        return asg_name, template_name, False, "Tag already exists"
+        entry.update(action='none', detail="Tag already exists")
+        return entry
 
-    #print("-"*80)
     image_location, ami_name, owner_id = get_ami_info(ec2_client, image_id)
-    #print(f"image_location: {image_location}\n ami_name: {ami_name}\n owner_id: {owner_id}\n")
-    #print("-" * 80)
-    vma_tag_value = get_vendor_tag_value(image_location, ami_name, owner_id) # will be true or false or tbd
-    #print(f"vma_tag_value: {vma_tag_value}")
-    #print("-" * 80)
-    TagSpecifications = create_instance_tags_list(lt_info, vma_tag_value)   
-    lt_dict = {'TagSpecifications': TagSpecifications}
-    new_lt = create_new_launch_template(ec2_client, template_name, lt_version, lt_dict)
-    new_lt_version = new_lt['LaunchTemplateVersion']['VersionNumber']
-    #print("*" * 80)
-    #print(f"New launch template version: {new_lt_version}")
-    #print("-"*80)
-    detail = ""
+    vma_tag_value = get_vendor_tag_value(image_location, ami_name, owner_id, image_id) # will be true or false or tbd
     if template_version.isdigit(): # have to update the asg to use new version number
-        #print("Updating ASG to use our new version number")
-        #print(asg_client, asg_name, template_name, new_lt_version)
-        r1 = update_asg_launch_template_version(asg_client, asg_name, template_name, str(new_lt_version))
-        detail = f"LT uses specific version number - original: {lt_version} new:{new_lt_version}"
-        #pprint.pprint(r1)
+        switch = 'asg'
     elif template_version == "$Default": # have to update launch template value of $Default
-       # print("Updating $Default to have our latest version number")
-        update_launch_template_default(ec2_client, template_name, str(new_lt_version))
+        switch = 'default'
+    else: # $Latest - no work to do, will use our newer version
+        switch = 'none'
+    entry.update(action='tag', vma_value=vma_tag_value, switch=switch,
+                 tag_specifications=create_instance_tags_list(lt_info, vma_tag_value))
+    return entry
+
+def apply_plan_entry(ec2_client, asg_client, entry, registry):
+    '''Write half of update_asg_tag: make the changes a plan entry describes - caller holds the template lock'''
+    asg_name = entry['asg_name']
+    template_name = entry.get('template_name', "None")
+
+    if entry['action'] == 'skip':
+        with _launch_config_file_lock:
+            write_launch_config_asg_file(entry['region'], asg_name)
+        registry.record(asg_name, checkpoint.SKIPPED, detail=entry['detail'])
+        registry.remember(asg_name, LAUNCH_CONFIGURATION, entry.get('launch_configuration'))
+        return asg_name, "None", False, entry['detail']
+    if entry['action'] == 'none':
+        print(f"ASG: {asg_name}, Launch Template {template_name}, already has tag 'Vendor_Managed_AMI' - will not update tags")
+        registry.record(asg_name, checkpoint.TAG_EXISTS, template_name=template_name, detail=entry['detail'])
+        registry.remember(asg_name, template_name, entry['template_version'], int(entry['source_version']), entry['image_id'])
+        return asg_name, template_name, False, entry['detail']
+
+    lt_version = entry['source_version']
+    new_lt_version = registry.created.get((template_name, lt_version))
+    if new_lt_version is None: # first ASG this run to need a tagged copy of this source version
+        lt_dict = {'TagSpecifications': entry['tag_specifications']}
+        new_lt = create_new_launch_template(ec2_client, template_name, lt_version, lt_dict)
+        new_lt_version = new_lt['LaunchTemplateVersion']['VersionNumber']
+        registry.created[(template_name, lt_version)] = new_lt_version
+        lt_catalog.catalog.note_new_version(ec2_client, template_name, new_lt_version)
+    registry.record(asg_name, checkpoint.LT_CREATED, template_name=template_name,
+                    source_version=lt_version, new_version=new_lt_version)
+    detail = ""
+    if entry['switch'] == 'asg': # have to update the asg to use new version number
+        update_asg_launch_template_version(asg_client, asg_name, template_name, str(new_lt_version))
+        detail = f"LT uses specific version number - original: {lt_version} new:{new_lt_version}"
+    elif entry['switch'] == 'default': # have to update launch template value of $Default
+        if registry.defaults.get(template_name) != new_lt_version: # a plan can hold several ASGs on one $Default
+            update_launch_template_default(ec2_client, template_name, str(new_lt_version))
+            lt_catalog.catalog.note_default_version(ec2_client, template_name, new_lt_version)
+            registry.defaults[template_name] = new_lt_version
         detail = f"LT uses $Default version - updated definition - original: {lt_version} new:{new_lt_version}"
-    elif template_version == "$Latest": # no work to do, will use our newer version
-        #print("ASG set to use latest, continuing")
+    elif entry['template_version'] == "$Latest": # no work to do, will use our newer version
         detail = f"LT uses $Latest version - noop - original: {lt_version} new:{new_lt_version}"
-        pass
     else:
         print(f"Should not see this printed - new corner case found for asg: {asg_name}")
+    registry.record(asg_name, checkpoint.UPDATED, detail="Tag created - " + detail)
+    # the tagged copy keeps the source AMI; an ASG pinned to a number now names the new one
+    version = str(new_lt_version) if entry['switch'] == 'asg' else entry['template_version']
+    registry.remember(asg_name, template_name, version, int(new_lt_version), entry['image_id'])
     return asg_name, template_name, True, "Tag created - " + detail
 
+def str_to_bool(value):
+    '''argparse type for true/false flag values'''
+    if value.lower() in ("true", "t", "yes", "y", "1"):
+        return True
+    if value.lower() in ("false", "f", "no", "n", "0"):
+        return False
+    raise argparse.ArgumentTypeError(f"expected true or false, got {value}")
+
 
 
 if __name__ == '__main__':
     argParser = argparse.ArgumentParser()
     argParser.add_argument("-n", "--num_asg", help="Number of ASGs to update", default=None, type=int)
-    argParser.add_argument("-d", "--dry_run", help="Dry run mode", default=True)
+    argParser.add_argument("-d", "--dry_run", help="Dry run mode (true/false) - only write a plan of the changes", default=True, type=str_to_bool)
     argParser.add_argument("-a", "--asg_name", help="Update Specific ASG by Name, requires -r region flag also", default=None)
     argParser.add_argument("-r", "--region", help="Region name for ASG", default=None)
+    argParser.add_argument("-w", "--workers", help="Number of ASGs to process in parallel", default=1, type=int)
+    argParser.add_argument("--ami_cache", help="JSON file caching AMI lookups between runs", default=None)
+    argParser.add_argument("--ami_cache_ttl", help="Seconds a cached AMI lookup stays valid", default=ami_cache.DEFAULT_TTL, type=int)
+    argParser.add_argument("--checkpoint", help="SQLite journal of per-ASG progress", default=CHECKPOINT)
+    argParser.add_argument("--resume", help="Skip ASGs the checkpoint journal has as finished, complete half-applied ones", action="store_true")
+    argParser.add_argument("--plan", help="JSON Lines file a dry run writes its plan to", default=None)
+    argParser.add_argument("--apply-plan", dest="apply_plan", help="Make the changes in a dry run plan without repeating the reads", default=None)
+    argParser.add_argument("--metrics", help="File prefix for the run's API metrics (.json and .prom)", default=None)
+    argParser.add_argument("--tag_index", help="Write a tag index snapshot (gzipped JSON) of the launch template versions read", default=None)
+    argParser.add_argument("--incremental", help="Only handle ASGs that are new or changed since the fingerprints saved in the checkpoint", action="store_true")
+    argParser.add_argument("-p", "--page_size", help="ASGs requested per describe_auto_scaling_groups page (max 100)", default=None, type=int)
 
     args = argParser.parse_args()
-    dry_run = bool(args.dry_run)  # passed in value is actually taken as string, must cast to bool
+    dry_run = args.dry_run
     
     '''print("args=%s" % args)
     print()
@@ -282,7 +540,9 @@ if __name__ == '__main__':
     print("*"*80)
     print()
     '''
-    main(dry_run, args.num_asg, args.asg_name, args.region)
+    main(dry_run, args.num_asg, args.asg_name, args.region, args.page_size, args.workers, args.ami_cache, args.ami_cache_ttl,
+         args.checkpoint, args.resume, args.plan, args.apply_plan, args.metrics, args.tag_index,
+         args.incremental)
 
 '''
 In a region, gather all asgs
@@ -294,14 +554,14 @@ In a region, gather all asgs
 - determine if Vendor_Managed_AMI tag exists
     yes? -> skip to next asg
     no? -> determine value for tag (true|false), and create new launch template version with new tag and value
-    ** update get_vendor_tag_value() with actual logic
+    ** DONE get_vendor_tag_value() classifies with the rules in vendor_rules.json
 - if asg lt version to use is:
     $Default -> update launch template definition of Default to be our new version
     an integer -> update ASG definition to use our version int(version)
     $Latest -> noop 
 
 ** Should also support:
-- dry run - just show what would be done
+- DONE dry run - just show what would be done
 - DONE limit to number of ASGs to act on (e.g. only run against X ASGs, then exit)
 
 
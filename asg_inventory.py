@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+'''Streaming Auto Scaling group inventory built on the autoscaling paginator'''
+import queue
+import threading
+
+from records import Asg
+
+PAGE_SIZE = 100 # describe_auto_scaling_groups MaxRecords upper limit
+PREFETCH_PAGES = 2 # pages buffered ahead of the consumer
+
+
+def iter_asg_pages(client, asg_names=None, page_size=PAGE_SIZE):
+    '''Yield each page (a list of ASG dicts) of describe_auto_scaling_groups'''
+    kwargs = {'PaginationConfig': {'PageSize': page_size}}
+    if asg_names:
+        kwargs['AutoScalingGroupNames'] = list(asg_names)
+    paginator = client.get_paginator('describe_auto_scaling_groups')
+    for page in paginator.paginate(**kwargs):
+        yield page.get('AutoScalingGroups', [])
+
+
+def _prefetch(iterable, depth):
+    '''Pull items from iterable on a background thread, at most depth items ahead'''
+    buf = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                buf.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((done, e))
+
+    worker = threading.Thread(target=producer, name="asg-page-prefetch", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, err = buf.get()
+            if item is done:
+                if err is not None:
+                    raise err
+                return
+            yield item
+    finally:
+        # consumer stopped early (e.g. --num_asg reached) - release the producer
+        stop.set()
+
+
+def _as_records(pages, keep_raw):
+    for page in pages:
+        yield [Asg.from_api(group, keep_raw) for group in page]
+
+
+def _with_page_hook(pages, on_page):
+    for page in pages:
+        on_page(page)
+        yield page
+
+
+def iter_asgs(client, asg_names=None, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES, on_page=None, keep_raw=None):
+    '''Yield ASGs one at a time as pages arrive, as records.Asg.
+
+    With prefetch > 0 the next pages are requested on a background thread while
+    the caller works on the current one; only prefetch + 1 pages are ever held
+    in memory regardless of how many groups exist in the region. on_page(page)
+    is called for every page before its ASGs are yielded - on the background
+    thread when prefetching, so it overlaps with work on earlier pages. Each
+    page's response dicts are dropped once converted unless keep_raw is set.
+    '''
+    pages = _as_records(iter_asg_pages(client, asg_names, page_size), keep_raw)
+    if on_page:
+        pages = _with_page_hook(pages, on_page)
+    if prefetch and prefetch > 0:
+        pages = _prefetch(pages, prefetch)
+    for page in pages:
+        yield from page
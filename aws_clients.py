@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+'''Shared boto3 clients - one per (service, region, settings) on one session, boto3 imported on first use'''
+import threading
+
+DEFAULT_REGION = "us-west-2"
+MAX_POOL_CONNECTIONS = 50 # botocore default is 10
+CONNECT_TIMEOUT = 5 # seconds
+READ_TIMEOUT = 30 # seconds
+TCP_KEEPALIVE = True # keep idle pooled connections open so calls skip the TCP/TLS handshake
+
+_session = None
+_clients = {} # (service, region, settings) -> client
+_lock = threading.Lock() # boto3 sessions are not thread-safe, clients are once created
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        import boto3 # deferred - importing boto3 and botocore.config takes a few hundred ms
+        _session = boto3.session.Session()
+    return _session
+
+
+def _config(settings):
+    from botocore.config import Config
+    options = {'max_pool_connections': MAX_POOL_CONNECTIONS, 'connect_timeout': CONNECT_TIMEOUT,
+               'read_timeout': READ_TIMEOUT, 'tcp_keepalive': TCP_KEEPALIVE,
+               'retries': {'mode': 'standard'}}
+    options.update(settings)
+    return Config(**options)
+
+
+def get_client(service, region=DEFAULT_REGION, **settings):
+    '''Return the process wide client for service in region, creating it on first use.
+
+    settings are botocore Config options overriding the defaults above; each
+    distinct set of settings gets its own client.
+    '''
+    key = (service, region, repr(sorted(settings.items())))
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = _get_session().client(service, region_name=region, config=_config(settings))
+    return client
+
+
+def new_resource(service, region=DEFAULT_REGION, **settings):
+    '''A new boto3 resource on the shared session; resources are not thread-safe, so callers keep one per thread'''
+    with _lock:
+        return _get_session().resource(service, region_name=region, config=_config(settings))
+
+
+def warm(services, region=DEFAULT_REGION):
+    '''Create clients ahead of the first call, e.g. at service start'''
+    return [get_client(service, region) for service in services]
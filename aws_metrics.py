@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+'''Per-call AWS API metrics - latency percentiles, retries and throttles per operation, JSON and Prometheus output'''
+import json
+import math
+import threading
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(sorted_values, q):
+    '''Nearest-rank percentile of an already sorted list'''
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class OperationStats:
+    __slots__ = ('calls', 'attempts', 'retries', 'throttles', 'errors', 'latencies')
+
+    def __init__(self):
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.throttles = 0
+        self.errors = 0
+        self.latencies = [] # seconds per logical call - rate limit waits, retries and backoff included
+
+
+class Recorder:
+    '''Thread-safe collector fed by aws_throttle.Governor for every API call a governed client makes'''
+    def __init__(self):
+        self.asgs = 0 # ASGs the run handled, for calls-per-ASG
+        self._ops = {} # (service, region, operation) -> OperationStats
+        self._lock = threading.Lock()
+
+    def record(self, service, region, operation, latency, attempts=1, throttles=0, error=False):
+        with self._lock:
+            stats = self._ops.get((service, region, operation))
+            if stats is None:
+                stats = self._ops[(service, region, operation)] = OperationStats()
+            stats.calls += 1
+            stats.attempts += attempts
+            stats.retries += attempts - 1
+            stats.throttles += throttles
+            stats.errors += 1 if error else 0
+            stats.latencies.append(latency)
+
+    def add_asgs(self, count):
+        with self._lock:
+            self.asgs += count
+
+    def summary(self):
+        '''Plain dict of the run: totals plus per-operation counts and latency percentiles'''
+        with self._lock:
+            ops = {key: (s.calls, s.attempts, s.retries, s.throttles, s.errors, sorted(s.latencies))
+                   for key, s in self._ops.items()}
+            asgs = self.asgs
+        operations = []
+        for (service, region, operation), (calls, attempts, retries, throttles, errors, latencies) in sorted(ops.items()):
+            entry = {'service': service, 'region': region, 'operation': operation, 'calls': calls,
+                     'attempts': attempts, 'retries': retries, 'throttles': throttles, 'errors': errors,
+                     'latency_sum': round(sum(latencies), 6),
+                     'calls_per_asg': round(calls / asgs, 3) if asgs else None}
+            for q in QUANTILES:
+                entry[f"p{int(q * 100)}"] = round(percentile(latencies, q), 6)
+            operations.append(entry)
+        attempts = sum(o['attempts'] for o in operations)
+        return {'asgs': asgs, 'api_calls': attempts, # every attempt counts against the account's API budget
+                'throttles': sum(o['throttles'] for o in operations),
+                'api_calls_per_asg': round(attempts / asgs, 3) if asgs else None,
+                'operations': operations}
+
+    def report(self):
+        '''Human readable table for the end of a run'''
+        summary = self.summary()
+        lines = [f"{'operation':<34} {'region':<12} {'calls':>6} {'/asg':>6} {'retry':>5} {'thrtl':>5} "
+                 f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"]
+        for o in summary['operations']:
+            per_asg = "" if o['calls_per_asg'] is None else o['calls_per_asg']
+            lines.append(f"{o['operation']:<34} {o['region']:<12} {o['calls']:>6} {per_asg:>6} {o['retries']:>5} "
+                         f"{o['throttles']:>5} {o['p50'] * 1000:>8.1f} {o['p95'] * 1000:>8.1f} {o['p99'] * 1000:>8.1f}")
+        lines.append(f"ASGs: {summary['asgs']}, API calls: {summary['api_calls']} "
+                     f"({summary['api_calls_per_asg']} per ASG), throttled: {summary['throttles']}")
+        return "\n".join(lines)
+
+    def prometheus(self):
+        '''Prometheus text exposition format'''
+        summary = self.summary()
+        out = []
+        counters = (('aws_api_calls_total', 'calls', "Logical AWS API calls"),
+                    ('aws_api_attempts_total', 'attempts', "AWS API requests sent, retries included"),
+                    ('aws_api_retries_total', 'retries', "AWS API retries"),
+                    ('aws_api_throttles_total', 'throttles', "AWS API throttling responses"),
+                    ('aws_api_errors_total', 'errors', "AWS API calls that failed after retries"))
+        for name, field, help_text in counters:
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} counter")
+            for o in summary['operations']:
+                out.append(f"{name}{{{_labels(o)}}} {o[field]}")
+        out.append("# HELP aws_api_latency_seconds AWS API call latency, rate limit waits and retries included")
+        out.append("# TYPE aws_api_latency_seconds summary")
+        for o in summary['operations']:
+            for q in QUANTILES:
+                out.append(f"aws_api_latency_seconds{{{_labels(o)},quantile=\"{q}\"}} {o[f'p{int(q * 100)}']}")
+            out.append(f"aws_api_latency_seconds_sum{{{_labels(o)}}} {o['latency_sum']}")
+            out.append(f"aws_api_latency_seconds_count{{{_labels(o)}}} {o['calls']}")
+        out.append("# HELP asg_run_asgs ASGs handled by the run")
+        out.append("# TYPE asg_run_asgs gauge")
+        out.append(f"asg_run_asgs {summary['asgs']}")
+        if summary['api_calls_per_asg'] is not None:
+            out.append("# HELP asg_run_api_calls_per_asg AWS API requests per ASG")
+            out.append("# TYPE asg_run_api_calls_per_asg gauge")
+            out.append(f"asg_run_api_calls_per_asg {summary['api_calls_per_asg']}")
+        return "\n".join(out) + "\n"
+
+    def write(self, prefix):
+        '''Write prefix.json and prefix.prom, returns both file names'''
+        json_file, prom_file = prefix + ".json", prefix + ".prom"
+        with open(json_file, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        with open(prom_file, 'w') as f:
+            f.write(self.prometheus())
+        return json_file, prom_file
+
+
+def _labels(o):
+    return f"service=\"{o['service']}\",region=\"{o['region']}\",operation=\"{o['operation']}\""
+
+
+recorder = Recorder() # process wide, fed by every governed client
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+'''Per-region client pools and a scheduler that works on every region at once'''
+import threading
+import concurrent.futures
+from aws_clients import get_client
+from aws_throttle import govern
+
+MAX_POOL_CONNECTIONS = 50 # botocore default is 10, too few once ASGs are processed in parallel
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_region_clients(region, max_pool_connections=MAX_POOL_CONNECTIONS):
+    '''Return the shared (ec2, autoscaling) client pair for a region, creating it on first use.
+
+    Both clients are governed by aws_throttle, which owns retries, so botocore's
+    own retry loop is disabled.
+    '''
+    key = (region, max_pool_connections)
+    with _clients_lock:
+        pair = _clients.get(key)
+        if pair is None:
+            settings = {'max_pool_connections': max_pool_connections,
+                        'retries': {'mode': 'standard', 'total_max_attempts': 1}}
+            pair = (govern(get_client('ec2', region, **settings)),
+                    govern(get_client('autoscaling', region, **settings)))
+            _clients[key] = pair
+    return pair
+
+
+def run_regions(fn, regions, *args, **kwargs):
+    '''Call fn(region, *args, **kwargs) for every region concurrently.
+
+    Returns the results in the same order as regions, so wall-clock time is that
+    of the slowest region rather than the sum. The first exception is re-raised.
+    '''
+    regions = list(regions)
+    if len(regions) <= 1:
+        return [fn(region, *args, **kwargs) for region in regions]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(regions), thread_name_prefix="region") as pool:
+        futures = [pool.submit(fn, region, *args, **kwargs) for region in regions]
+        return [f.result() for f in futures]
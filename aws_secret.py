@@ -4,36 +4,169 @@
 # or implementing the sample code, visit the AWS docs:
 # https://aws.amazon.com/developer/language/python/
 
-import boto3
+import logging
+import threading
+import time
+
 from botocore.exceptions import ClientError
 
+from aws_clients import get_client
+from batch import batched
+
+logger = logging.getLogger(__name__)
+
+SECRET_NAME = "token"
+REGION_NAME = "us-west-2"
+DEFAULT_TTL = 300 # seconds a secret is served from memory
+REFRESH_AHEAD = 60 # seconds before expiry a background refresh starts
+BATCH_SIZE = 20 # BatchGetSecretValue SecretIdList limit
+
+
+class _Entry:
+    __slots__ = ('value', 'version_id', 'expires', 'refresh_at')
+
+    def __init__(self, value, version_id, expires, refresh_at):
+        self.value = value
+        self.version_id = version_id
+        self.expires = expires
+        self.refresh_at = refresh_at
+
+
+class SecretProvider:
+    '''In-memory cache of Secrets Manager secrets with refresh ahead of expiry.
+
+    get() is a dictionary lookup while a secret is fresh. Once a secret is
+    within refresh_ahead seconds of expiring, one background thread checks its
+    AWSCURRENT version with describe_secret and only fetches the value again
+    if the version changed. An expired secret is fetched synchronously, with
+    concurrent callers sharing one request. get_many() fills the cache with
+    BatchGetSecretValue. The client is the process wide one from aws_clients.
+    '''
+    def __init__(self, client=None, region=REGION_NAME, ttl=DEFAULT_TTL, refresh_ahead=REFRESH_AHEAD):
+        self.region = region
+        self.ttl = ttl
+        # at most half the TTL, so a short TTL still leaves a window of plain memory reads after each fetch
+        self.refresh_ahead = min(refresh_ahead, ttl / 2)
+        self.api_calls = 0
+        self._client = client
+        self._entries = {} # secret id -> _Entry
+        self._inflight = {} # secret id -> threading.Event of a synchronous fetch
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_client('secretsmanager', self.region)
+        return self._client
+
+    def get(self, secret_id=SECRET_NAME):
+        '''The secret's SecretString (or SecretBinary)'''
+        now = time.monotonic()
+        entry = self._entries.get(secret_id)
+        if entry is not None and now < entry.expires:
+            if now >= entry.refresh_at:
+                self._refresh_in_background(secret_id)
+            return entry.value
+        return self._fetch(secret_id)
+
+    def get_many(self, secret_ids):
+        '''{secret id: value} for every id, fetching the ones not cached with BatchGetSecretValue'''
+        now = time.monotonic()
+        missing = [s for s in dict.fromkeys(secret_ids)
+                   if s not in self._entries or now >= self._entries[s].expires]
+        for chunk in batched(missing, BATCH_SIZE):
+            self._count_call()
+            response = self.client.batch_get_secret_value(SecretIdList=chunk)
+            for secret in response.get('SecretValues', []):
+                # ARN and Name both point at the same entry, depending on what the caller asked for
+                for key in (secret['ARN'], secret['Name']):
+                    if key in chunk:
+                        self._store(key, secret)
+            for error in response.get('Errors', []):
+                logger.warning("BatchGetSecretValue could not read %s: %s", error.get('SecretId'), error.get('ErrorCode'))
+        # anything the batch could not read goes through get(), which raises the proper ClientError
+        return {s: self.get(s) for s in dict.fromkeys(secret_ids)}
+
+    def invalidate(self, secret_id=None):
+        with self._lock:
+            if secret_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(secret_id, None)
+
+    def _count_call(self):
+        with self._lock:
+            self.api_calls += 1
+
+    def _store(self, secret_id, response):
+        now = time.monotonic()
+        value = response.get('SecretString', response.get('SecretBinary'))
+        with self._lock:
+            self._entries[secret_id] = _Entry(value, response.get('VersionId'), now + self.ttl,
+                                              now + self.ttl - self.refresh_ahead)
+        return value
+
+    def _fetch(self, secret_id):
+        while True:
+            with self._lock:
+                entry = self._entries.get(secret_id)
+                if entry is not None and time.monotonic() < entry.expires:
+                    return entry.value
+                event = self._inflight.get(secret_id)
+                owner = event is None
+                if owner:
+                    event = self._inflight[secret_id] = threading.Event()
+            if not owner:
+                event.wait()
+                continue
+            try:
+                self._count_call()
+                # For a list of exceptions thrown, see
+                # https://docs.aws.amazon.com/secretsmanager/latest/apireference/API_GetSecretValue.html
+                return self._store(secret_id, self.client.get_secret_value(SecretId=secret_id))
+            finally:
+                with self._lock:
+                    self._inflight.pop(secret_id, None)
+                event.set()
+
+    def _refresh_in_background(self, secret_id):
+        with self._lock:
+            if secret_id in self._refreshing:
+                return
+            self._refreshing.add(secret_id)
+        threading.Thread(target=self._refresh, args=(secret_id,), name=f"secret-refresh-{secret_id}", daemon=True).start()
+
+    def _refresh(self, secret_id):
+        try:
+            entry = self._entries.get(secret_id)
+            self._count_call()
+            stages = self.client.describe_secret(SecretId=secret_id).get('VersionIdsToStages', {})
+            current = next((v for v, s in stages.items() if 'AWSCURRENT' in s), None)
+            if entry is not None and current is not None and current == entry.version_id:
+                now = time.monotonic()
+                with self._lock: # same version - keep the value, restart its clock
+                    entry.expires = now + self.ttl
+                    entry.refresh_at = now + self.ttl - self.refresh_ahead
+                return
+            self._count_call()
+            self._store(secret_id, self.client.get_secret_value(SecretId=secret_id))
+        except ClientError as e:
+            # the cached value stays until it expires; get() then fetches synchronously and raises
+            logger.warning("Background refresh of secret %s failed: %s", secret_id, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(secret_id)
 
-def get_secret():
 
-    secret_name = "token"
-    region_name = "us-west-2"
+provider = SecretProvider() # process wide; no AWS call until the first get()
 
-    # Create a Secrets Manager client
-    session = boto3.session.Session()
-    print(f"session: {session}")
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=region_name
-    )
 
-    try:
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
-        )
-        print(f"get_secret_value_response: {get_secret_value_response}")
-    except ClientError as e:
-        # For a list of exceptions thrown, see
-        # https://docs.aws.amazon.com/secretsmanager/latest/apireference/API_GetSecretValue.html
-        raise e
-        print(e)
+def get_secret(secret_name=SECRET_NAME):
+    # Decrypted SecretString, from memory after the first call
+    return provider.get(secret_name)
 
-    # Decrypts secret using the associated KMS key.
-    secret = get_secret_value_response['SecretString']
-    print(f"Secret: {secret}")
 
-get_secret()
\ No newline at end of file
+if __name__ == "__main__":
+    secret = get_secret()
+    print(f"Read secret {SECRET_NAME} ({len(secret)} characters)")
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+'''Call governance for boto3 clients - token bucket rate limit, AIMD concurrency and throttle-aware retries'''
+import random
+import threading
+import time
+import logging
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+import aws_metrics
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_CODES = {'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestLimitExceeded',
+                  'RequestThrottled', 'RequestThrottledException', 'TooManyRequestsException',
+                  'ProvisionedThroughputExceededException', 'SlowDown'}
+TRANSIENT_CODES = {'RequestTimeout', 'RequestTimeoutException', 'InternalError', 'InternalFailure',
+                   'ServiceUnavailable', 'Unavailable'}
+
+# steady state requests per second per (service, region) - below the documented EC2/ASG refill rates
+DEFAULT_RATES = {'ec2': 20.0, 'autoscaling': 10.0}
+DEFAULT_RATE = 10.0
+MAX_CONCURRENCY = 32 # AIMD ceiling for in-flight calls per (service, region)
+MAX_ATTEMPTS = 8
+BASE_DELAY = 0.25 # seconds, doubled every attempt
+MAX_DELAY = 20.0
+THROTTLE = "throttle"
+TRANSIENT = "transient"
+
+_checkers = None # botocore's standard retry mode checkers, imported on the first error
+
+
+def _standard_checkers():
+    global _checkers
+    if _checkers is None:
+        from botocore.retries import standard # deferred - pulls in botocore.utils, ~200 ms
+        _checkers = (standard.RetryContext, standard.ThrottledRetryableChecker(), standard.TransientRetryableChecker())
+    return _checkers
+
+
+def classify(err):
+    '''THROTTLE, TRANSIENT or None (not retryable) for an exception raised by an API call.
+
+    Covers what botocore's standard retry mode retries - its throttle and
+    transient error codes, 429 and 5xx responses, connection and HTTP client
+    errors such as read timeouts - plus THROTTLE_CODES and TRANSIENT_CODES.
+    '''
+    if isinstance(err, ClientError):
+        code = err.response.get('Error', {}).get('Code')
+        status = err.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        retry_context, throttled, transient = _standard_checkers()
+        context = retry_context(1, parsed_response=err.response)
+        if code in THROTTLE_CODES or status == 429 or throttled.is_retryable(context):
+            return THROTTLE
+        if code in TRANSIENT_CODES or status >= 500 or transient.is_retryable(context):
+            return TRANSIENT
+        return None
+    if isinstance(err, (BotoConnectionError, HTTPClientError)):
+        return TRANSIENT
+    return None
+
+
+class TokenBucket:
+    '''Classic token bucket - acquire() blocks until a token is available'''
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        '''Take a token if one is available, else return the seconds until one will be - caller holds the lock'''
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def try_acquire(self):
+        with self._lock:
+            return self._take() == 0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    '''Limit on in-flight calls: additive increase on success, multiplicative decrease on throttle'''
+    def __init__(self, initial=8, minimum=1, maximum=MAX_CONCURRENCY, backoff_ratio=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff_ratio = backoff_ratio
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    def on_success(self):
+        with self._cond:
+            before = int(self.limit)
+            # roughly +1 per limit's worth of successful calls
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            if int(self.limit) > before:
+                self._cond.notify()
+
+    def on_throttle(self):
+        with self._cond:
+            now = time.monotonic()
+            # a burst of throttles from calls already in flight counts as one signal
+            if now - self._last_decrease < 1.0:
+                return
+            self._last_decrease = now
+            self.limit = max(self.minimum, self.limit * self.backoff_ratio)
+
+
+class Governor:
+    '''Rate limit, concurrency limit and retry policy shared by every client of one (service, region)'''
+    def __init__(self, service, region, rate=None, max_concurrency=MAX_CONCURRENCY):
+        self.service = service
+        self.region = region
+        self.bucket = TokenBucket(rate or DEFAULT_RATES.get(service, DEFAULT_RATE))
+        self.concurrency = AdaptiveConcurrency(maximum=max_concurrency)
+        self.calls = 0
+        self.retries = 0
+        self.throttles = 0
+        self._stats_lock = threading.Lock()
+
+    def _count(self, field):
+        with self._stats_lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def call(self, fn, operation_name, *args, **kwargs):
+        '''Run fn(*args, **kwargs), retrying throttles and transient errors with full-jitter backoff.
+        Every call is reported to aws_metrics.recorder.'''
+        start = time.perf_counter()
+        attempts = throttles = 0
+        ok = False
+        try:
+            for attempt in range(MAX_ATTEMPTS):
+                self.bucket.acquire()
+                self.concurrency.acquire()
+                self._count('calls')
+                attempts += 1
+                try:
+                    result = fn(*args, **kwargs)
+                except (ClientError, BotoConnectionError, HTTPClientError) as err:
+                    kind = classify(err)
+                    if kind is None:
+                        raise
+                    if kind == THROTTLE:
+                        self._count('throttles')
+                        throttles += 1
+                        self.concurrency.on_throttle()
+                    last_error = err
+                else:
+                    self.concurrency.on_success()
+                    ok = True
+                    return result
+                finally:
+                    self.concurrency.release()
+                if attempt + 1 < MAX_ATTEMPTS:
+                    self._count('retries')
+                    delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+                    logger.info("%s.%s in %s: %s, retrying in %.2fs", self.service, operation_name,
+                                self.region, last_error, delay)
+                    time.sleep(delay)
+            raise last_error
+        finally:
+            aws_metrics.recorder.record(self.service, self.region, operation_name, time.perf_counter() - start,
+                                        attempts, throttles, error=not ok)
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(service, region):
+    '''Return the process wide Governor for a (service, region)'''
+    with _governors_lock:
+        governor = _governors.get((service, region))
+        if governor is None:
+            governor = _governors[(service, region)] = Governor(service, region)
+    return governor
+
+
+def govern(client):
+    '''Route every API call a boto3 client makes - including paginator pages - through its Governor.
+
+    botocore's own retries should be turned off on the client (total_max_attempts=1)
+    so throttles are not retried twice. A retried call may already have landed,
+    so calls that are not idempotent must carry a ClientToken, as
+    create_launch_template_version does through lt_catalog.client_token().
+    '''
+    if getattr(client, '_governor', None):
+        return client
+    governor = get_governor(client.meta.service_model.service_name, client.meta.region_name)
+    make_api_call = client._make_api_call
+
+    def governed_api_call(operation_name, api_params):
+        return governor.call(make_api_call, operation_name, operation_name, api_params)
+
+    client._make_api_call = governed_api_call
+    client._governor = governor
+    return client
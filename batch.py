@@ -1,20 +1,128 @@
 #!/usr/bin/env python3
+'''Lazy batching of any iterable - by count, by weight (e.g. bytes), by time window, and for async iterables.
 
-mylist = "a b c d e f g h i j k l".split()
-
-bsize = 3
-start = 0
-end = bsize
-rounds = len(mylist) // bsize
-modulo = len(mylist) % bsize # check if we need to grab extra
-
-for i in range(rounds):
-    #print(f"start: {start}")
-    #print(f"end: {end}")
-    tl = mylist[start:end]
-    print(tl)
-    start += bsize
-    end += bsize
-if modulo:
-    tl = mylist[start:]
-    print(tl)
\ No newline at end of file
+Batches are lists pulled from an iterator as they are needed, so inputs can be
+generators, file objects or queues of unbounded length. Service limits:
+describe_images 100 ids, BatchWriteItem 25 items, BatchGetItem 100 keys,
+put_log_events 10,000 events / 1 MB (see cloudwatch_logs_push.split_batches).
+'''
+import asyncio
+import itertools
+import queue
+import time
+
+DONE = object() # put on a queue to end windowed() over it
+
+
+def batched(iterable, size):
+    '''Yield lists of up to size items, in order; the last one may be short'''
+    if size < 1:
+        raise ValueError("size must be at least 1")
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def weighted(iterable, max_weight, weight=len, max_count=None):
+    '''Yield lists whose summed weight(item) stays within max_weight (and length within max_count).
+
+    An item heavier than max_weight on its own is yielded alone rather than dropped.
+    '''
+    chunk, total = [], 0
+    for item in iterable:
+        w = weight(item)
+        if chunk and (total + w > max_weight or (max_count and len(chunk) >= max_count)):
+            yield chunk
+            chunk, total = [], 0
+        chunk.append(item)
+        total += w
+    if chunk:
+        yield chunk
+
+
+def windowed(source, size, max_wait, clock=time.monotonic):
+    '''Yield batches of up to size items, never holding an item longer than max_wait seconds.
+
+    source is a queue.Queue (ended by putting DONE) or an iterable. A queue is
+    read with timeouts, so a partial batch is yielded on time even while the
+    producer is quiet; a plain iterable can only be checked as each item arrives.
+    '''
+    if not isinstance(source, queue.Queue):
+        chunk, deadline = [], None
+        for item in source:
+            if not chunk:
+                deadline = clock() + max_wait
+            chunk.append(item)
+            if len(chunk) >= size or clock() >= deadline:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+        return
+    chunk, deadline = [], None
+    while True:
+        try:
+            item = source.get(timeout=max(0.0, deadline - clock()) if chunk else None)
+        except queue.Empty:
+            yield chunk
+            chunk = []
+            continue
+        if item is DONE:
+            break
+        if not chunk:
+            deadline = clock() + max_wait
+        chunk.append(item)
+        if len(chunk) >= size or clock() >= deadline:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def abatched(aiterable, size, max_wait=None):
+    '''Async batched(); with max_wait a partial batch is yielded once its first item has waited that long'''
+    if size < 1:
+        raise ValueError("size must be at least 1")
+    it = aiterable.__aiter__()
+    loop = asyncio.get_running_loop()
+    chunk, deadline = [], None
+    pending = None # the __anext__ in flight survives a timeout instead of being cancelled
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(it.__anext__())
+            timeout = None if not chunk or max_wait is None else max(0.0, deadline - loop.time())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield chunk
+                chunk = []
+                continue
+            try:
+                item = pending.result()
+            except StopAsyncIteration:
+                pending = None
+                break
+            pending = None
+            if not chunk and max_wait is not None:
+                deadline = loop.time() + max_wait
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+if __name__ == "__main__":
+    mylist = "a b c d e f g h i j k l".split()
+
+    for tl in batched(mylist, 3):
+        print(tl)
+    for tl in weighted(["aaaa", "bb", "cccccc", "d", "ee"], max_weight=6):
+        print(tl)
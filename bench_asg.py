@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+'''Offline benchmark of asg_info.main against fake_aws - API calls, wall-clock time and peak memory per strategy'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import ami_cache
+import asg_info
+import aws_metrics
+import aws_throttle
+import lt_catalog
+import records
+from fake_aws import FakeFleet
+
+# strategy -> how asg_info runs: worker count ("N" = --workers), launch template catalogue and AMI cache
+# memoization, page prefetch, AMI cache warm from an earlier run
+STRATEGIES = {
+    'uncached': {'workers': 1, 'memoize': False, 'prefetch': False, 'warm_ami_cache': False},
+    'serial': {'workers': 1, 'memoize': True, 'prefetch': False, 'warm_ami_cache': False},
+    'threaded': {'workers': "N", 'memoize': True, 'prefetch': False, 'warm_ami_cache': False},
+    'batched': {'workers': "N", 'memoize': True, 'prefetch': True, 'warm_ami_cache': False},
+    'cached': {'workers': "N", 'memoize': True, 'prefetch': True, 'warm_ami_cache': True},
+}
+
+
+def uncached_lt_info(ec2_client, template_name, version):
+    '''asg_info.get_lt_info as it was before the catalogue - one describe_launch_template_versions per ASG'''
+    response = ec2_client.describe_launch_template_versions(LaunchTemplateName=template_name, Versions=[version])
+    return records.LaunchTemplateVersion.from_api(response['LaunchTemplateVersions'][0])
+
+
+def uncached_ami_info(ec2_client, ami_id):
+    '''asg_info.get_ami_info as it was before the AMI cache - one describe_images per ASG'''
+    images = ec2_client.describe_images(ImageIds=[ami_id])['Images']
+    return records.AmiInfo.from_api(images[0]) if images else records.AmiInfo()
+
+
+def reset_state():
+    '''Drop every process wide cache so each strategy starts cold'''
+    lt_catalog.catalog = lt_catalog.LaunchTemplateCatalog()
+    ami_cache.resolver = ami_cache.AmiResolver()
+    aws_throttle._governors.clear()
+    aws_metrics.recorder = aws_metrics.Recorder()
+
+
+def run_strategy(name, args):
+    settings = STRATEGIES[name]
+    workers = args.workers if settings['workers'] == "N" else settings['workers']
+    reset_state()
+    fleet = FakeFleet(args.asgs, args.templates, args.amis, args.latency, args.throttle_rate)
+    ec2_client, asg_client = (aws_throttle.govern(c) for c in fleet.clients())
+    asg_info.get_region_clients = lambda region, *a, **kw: (ec2_client, asg_client)
+    asg_info.REGIONS = [fleet.region]
+    asg_info.PREFETCH_LOOKUPS = settings['prefetch']
+    if settings['warm_ami_cache']: # what --ami_cache gives a repeat run
+        ami_cache.resolver.prefetch(ec2_client, fleet.images)
+        fleet.calls.clear()
+
+    memoized = asg_info.get_lt_info, asg_info.get_ami_info
+    if not settings['memoize']: # the original one-call-per-ASG lookups, as a baseline for the rest
+        asg_info.get_lt_info, asg_info.get_ami_info = uncached_lt_info, uncached_ami_info
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            tracemalloc.start()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                asg_info.main(dry_run=False, workers=workers, checkpoint_file=os.path.join(tmp, "checkpoint.sqlite"))
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        finally:
+            os.chdir(cwd)
+            asg_info.get_lt_info, asg_info.get_ami_info = memoized
+
+    governor = ec2_client._governor
+    calls = dict(fleet.calls)
+    return {'strategy': name, 'workers': workers, 'wall_seconds': round(elapsed, 3),
+            'api_calls': sum(v for k, v in calls.items() if k != 'throttled'),
+            'throttled': calls.pop('throttled', 0), 'retries': governor.retries + asg_client._governor.retries,
+            'peak_mb': round(peak / 1e6, 2), 'calls_by_operation': calls}
+
+
+def print_results(results, baseline=None):
+    base = {r['strategy']: r for r in baseline or []}
+    print(f"{'strategy':<10} {'workers':>7} {'wall s':>8} {'api calls':>9} {'throttled':>9} {'peak MB':>8}  vs baseline")
+    for r in results:
+        delta = ""
+        b = base.get(r['strategy'])
+        if b:
+            delta = f"wall x{r['wall_seconds'] / max(b['wall_seconds'], 1e-9):.2f}, calls x{r['api_calls'] / max(b['api_calls'], 1):.2f}"
+        print(f"{r['strategy']:<10} {r['workers']:>7} {r['wall_seconds']:>8} {r['api_calls']:>9} {r['throttled']:>9} {r['peak_mb']:>8}  {delta}")
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("--asgs", help="Number of ASGs in the fake fleet", default=1000, type=int)
+    argParser.add_argument("--templates", help="Number of launch templates they share", default=100, type=int)
+    argParser.add_argument("--amis", help="Number of distinct AMIs", default=10, type=int)
+    argParser.add_argument("--latency", help="Seconds every fake API call takes", default=0.005, type=float)
+    argParser.add_argument("--throttle_rate", help="Calls per second per service before the fake throttles", default=None, type=float)
+    argParser.add_argument("--api_rate", help="Client side rate limit per service (aws_throttle)", default=1000.0, type=float)
+    argParser.add_argument("-w", "--workers", help="Workers for the threaded strategies", default=16, type=int)
+    argParser.add_argument("-s", "--strategies", help="Comma separated subset of " + ",".join(STRATEGIES), default=",".join(STRATEGIES))
+    argParser.add_argument("-o", "--output", help="Write results as JSON, e.g. to use as a later --baseline", default=None)
+    argParser.add_argument("-b", "--baseline", help="JSON results of an earlier run to compare against", default=None)
+    args = argParser.parse_args()
+
+    aws_throttle.DEFAULT_RATES = {'ec2': args.api_rate, 'autoscaling': args.api_rate}
+    results = [run_strategy(name, args) for name in args.strategies.split(",")]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
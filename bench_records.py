@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+'''Memory benchmark - describe_* response dicts held as-is versus the records module's compact records'''
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from records import AmiInfo, Asg, LaunchTemplateVersion
+
+KINDS = ('asg', 'lt_version', 'ami')
+
+
+def asg_payload(i, instances=4):
+    '''A describe_auto_scaling_groups entry shaped like a real one, with its instances and tags'''
+    name = f"asg-{i}"
+    return {
+        'AutoScalingGroupName': name,
+        'AutoScalingGroupARN': f"arn:aws:autoscaling:us-west-2:123456789012:autoScalingGroup:{i:08x}-1f2e-4d3c-9b8a:autoScalingGroupName/{name}",
+        'LaunchTemplate': {'LaunchTemplateId': f"lt-{i % 500:017x}", 'LaunchTemplateName': f"lt-{i % 500}",
+                           'Version': ("$Default", "$Latest", str(i % 7 + 1))[i % 3]},
+        'MinSize': 1, 'MaxSize': 10, 'DesiredCapacity': instances, 'DefaultCooldown': 300,
+        'AvailabilityZones': ["us-west-2a", "us-west-2b", "us-west-2c"],
+        'LoadBalancerNames': [], 'TargetGroupARNs': [f"arn:aws:elasticloadbalancing:us-west-2:123456789012:targetgroup/tg-{i}/{i:016x}"],
+        'HealthCheckType': "ELB", 'HealthCheckGracePeriod': 300,
+        'Instances': [{'InstanceId': f"i-{i:08x}{n:09x}", 'InstanceType': "m5.large", 'AvailabilityZone': f"us-west-2{'abc'[n % 3]}",
+                       'LifecycleState': "InService", 'HealthStatus': "Healthy", 'ProtectedFromScaleIn': False,
+                       'LaunchTemplate': {'LaunchTemplateId': f"lt-{i % 500:017x}", 'LaunchTemplateName': f"lt-{i % 500}", 'Version': "3"}}
+                      for n in range(instances)],
+        'CreatedTime': "2024-03-01T12:00:00.000Z",
+        'SuspendedProcesses': [], 'VPCZoneIdentifier': "subnet-0a1b2c3d4e5f60718,subnet-0a1b2c3d4e5f60719,subnet-0a1b2c3d4e5f6071a",
+        'EnabledMetrics': [], 'Tags': [{'ResourceId': name, 'ResourceType': "auto-scaling-group", 'Key': key,
+                                        'Value': f"{key}-{i % 40}", 'PropagateAtLaunch': True}
+                                       for key in ("team", "service", "env", "cost-center")],
+        'TerminationPolicies': ["Default"], 'NewInstancesProtectedFromScaleIn': False,
+        'ServiceLinkedRoleARN': "arn:aws:iam::123456789012:role/aws-service-role/autoscaling.amazonaws.com/AWSServiceRoleForAutoScaling",
+        'CapacityRebalance': False, 'TrafficSources': [],
+    }
+
+
+def lt_version_payload(i):
+    '''A describe_launch_template_versions entry with user data, block devices and network interfaces'''
+    return {
+        'LaunchTemplateId': f"lt-{i:017x}", 'LaunchTemplateName': f"lt-{i // 4}", 'VersionNumber': i % 4 + 1,
+        'VersionDescription': "nightly build", 'CreateTime': "2024-03-01T12:00:00.000Z",
+        'CreatedBy': "arn:aws:sts::123456789012:assumed-role/deployer/ci", 'DefaultVersion': i % 4 == 0,
+        'LaunchTemplateData': {
+            'ImageId': f"ami-{i % 50:017x}", 'InstanceType': "m5.large", 'KeyName': "ops",
+            'IamInstanceProfile': {'Arn': "arn:aws:iam::123456789012:instance-profile/app"},
+            'UserData': "IyEvYmluL2Jhc2gKc2V0IC1ldQo=" * 40, # base64 bootstrap scripts run to a few KB
+            'BlockDeviceMappings': [{'DeviceName': "/dev/xvda", 'Ebs': {'VolumeSize': 50, 'VolumeType': "gp3",
+                                                                       'DeleteOnTermination': True, 'Encrypted': True}}],
+            'NetworkInterfaces': [{'DeviceIndex': 0, 'AssociatePublicIpAddress': False,
+                                   'Groups': ["sg-0a1b2c3d4e5f60718", "sg-0a1b2c3d4e5f60719"], 'DeleteOnTermination': True}],
+            'MetadataOptions': {'HttpTokens': "required", 'HttpPutResponseHopLimit': 2, 'HttpEndpoint': "enabled"},
+            'Monitoring': {'Enabled': True},
+            'TagSpecifications': [{'ResourceType': rtype, 'Tags': [{'Key': key, 'Value': f"{key}-{i % 40}"}
+                                                                  for key in ("team", "service", "env")]}
+                                  for rtype in ("instance", "volume")],
+        },
+    }
+
+
+def ami_payload(i):
+    '''A describe_images entry'''
+    return {
+        'ImageId': f"ami-{i:017x}", 'ImageLocation': f"123456789012/golden-{i}", 'Name': f"golden-{i}",
+        'OwnerId': "123456789012", 'State': "available", 'Architecture': "x86_64", 'ImageType': "machine",
+        'Public': False, 'PlatformDetails': "Linux/UNIX", 'UsageOperation': "RunInstances",
+        'CreationDate': "2024-03-01T12:00:00.000Z", 'RootDeviceName': "/dev/xvda", 'RootDeviceType': "ebs",
+        'VirtualizationType': "hvm", 'EnaSupport': True, 'Hypervisor': "xen",
+        'BlockDeviceMappings': [{'DeviceName': "/dev/xvda", 'Ebs': {'SnapshotId': f"snap-{i:017x}", 'VolumeSize': 8,
+                                                                   'VolumeType': "gp3", 'DeleteOnTermination': True,
+                                                                   'Encrypted': False}}],
+        'Tags': [{'Key': "build", 'Value': str(i)}],
+    }
+
+
+# kind -> (payload generator, what the dict flow keeps, what the record flow keeps)
+FLOWS = {
+    'asg': (asg_payload, lambda p: p, Asg.from_api),
+    'lt_version': (lt_version_payload, lambda p: p, LaunchTemplateVersion.from_api),
+    'ami': (ami_payload, lambda p: p, AmiInfo.from_api),
+}
+
+
+def measure(kind, flow, count):
+    '''Bytes still allocated after holding count items of kind the given way, and seconds taken.
+
+    Payloads are generated one at a time, as a paginated response would deliver
+    them, so the dict flow keeps every payload while the record flow lets each
+    one go as soon as its record is built.
+    '''
+    make, keep_dict, keep_record = FLOWS[kind]
+    keep = keep_dict if flow == 'dict' else keep_record
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    held = [keep(make(i)) for i in range(count)]
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return current, elapsed
+
+
+def run(kinds, count):
+    results = []
+    for kind in kinds:
+        dict_bytes, dict_seconds = measure(kind, 'dict', count)
+        record_bytes, record_seconds = measure(kind, 'record', count)
+        results.append({'kind': kind, 'count': count, 'dict_mb': round(dict_bytes / 1e6, 2),
+                        'record_mb': round(record_bytes / 1e6, 2), 'ratio': round(dict_bytes / max(record_bytes, 1), 1),
+                        'dict_seconds': round(dict_seconds, 3), 'record_seconds': round(record_seconds, 3)})
+    return results
+
+
+def print_results(results):
+    print(f"{'kind':<11} {'count':>7} {'dict MB':>9} {'record MB':>9} {'smaller':>8} {'dict s':>7} {'record s':>8}")
+    for r in results:
+        print(f"{r['kind']:<11} {r['count']:>7} {r['dict_mb']:>9} {r['record_mb']:>9} {'x' + str(r['ratio']):>8} "
+              f"{r['dict_seconds']:>7} {r['record_seconds']:>8}")
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("-n", "--count", help="Items of each kind held in memory", default=20000, type=int)
+    argParser.add_argument("-k", "--kinds", help="Comma separated subset of " + ",".join(KINDS), default=",".join(KINDS))
+    argParser.add_argument("-o", "--output", help="Write results as JSON", default=None)
+    args = argParser.parse_args()
+
+    results = run(args.kinds.split(","), args.count)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
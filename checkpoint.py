@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+'''SQLite journal of per-ASG progress so an interrupted fleet update can be resumed'''
+import sqlite3
+import threading
+import time
+
+PENDING = "pending" # handed to a worker, nothing written yet
+SKIPPED = "skipped" # uses a launch configuration
+TAG_EXISTS = "tag_exists" # nothing to do
+LT_CREATED = "lt_version_created" # tagged version exists, ASG / $Default not switched yet
+UPDATED = "updated" # finished
+DONE_STATES = (SKIPPED, TAG_EXISTS, UPDATED)
+
+
+class Checkpoint:
+    '''Thread-safe per-ASG state journal, one row per (region, asg_name).
+
+    Every record() is committed straight away (WAL, synchronous=NORMAL) so the
+    journal survives the process dying at any point.
+    '''
+    def __init__(self, path, resume=False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS asg_state (
+            region TEXT NOT NULL, asg_name TEXT NOT NULL, state TEXT NOT NULL,
+            template_name TEXT, source_version TEXT, new_version TEXT, detail TEXT,
+            updated_at REAL NOT NULL, PRIMARY KEY (region, asg_name))""")
+        # fingerprints outlive a run - they are what --incremental compares against next time
+        self._db.execute("""CREATE TABLE IF NOT EXISTS asg_fingerprint (
+            region TEXT NOT NULL, asg_name TEXT NOT NULL, fingerprint TEXT NOT NULL, image_id TEXT,
+            updated_at REAL NOT NULL, PRIMARY KEY (region, asg_name))""")
+        if not resume:
+            self._db.execute("DELETE FROM asg_state")
+
+    def record(self, region, asg_name, state, template_name=None, source_version=None, new_version=None, detail=None):
+        '''Upsert the state of one ASG, keeping earlier template/version details when not given'''
+        with self._lock:
+            self._db.execute("""INSERT INTO asg_state VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (region, asg_name) DO UPDATE SET state=excluded.state,
+                    template_name=COALESCE(excluded.template_name, template_name),
+                    source_version=COALESCE(excluded.source_version, source_version),
+                    new_version=COALESCE(excluded.new_version, new_version),
+                    detail=COALESCE(excluded.detail, detail),
+                    updated_at=excluded.updated_at""",
+                (region, asg_name, state, template_name, source_version,
+                 None if new_version is None else str(new_version), detail, time.time()))
+
+    def completed(self, region):
+        '''Names of the ASGs in region that need no more work'''
+        with self._lock:
+            rows = self._db.execute("SELECT asg_name FROM asg_state WHERE region = ? AND state IN (?, ?, ?)",
+                                    (region,) + DONE_STATES).fetchall()
+        return {row[0] for row in rows}
+
+    def created_versions(self, region):
+        '''{(template_name, source_version): new_version} for every tagged version created in region'''
+        with self._lock:
+            rows = self._db.execute("""SELECT template_name, source_version, new_version FROM asg_state
+                WHERE region = ? AND new_version IS NOT NULL""", (region,)).fetchall()
+        return {(template, source): int(new) for template, source, new in rows}
+
+    def save_fingerprint(self, region, asg_name, fingerprint, image_id=None):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO asg_fingerprint VALUES (?, ?, ?, ?, ?)",
+                             (region, asg_name, fingerprint, image_id, time.time()))
+
+    def fingerprints(self, region):
+        '''{asg_name: (fingerprint, image_id)} as left by earlier runs in region'''
+        with self._lock:
+            rows = self._db.execute("SELECT asg_name, fingerprint, image_id FROM asg_fingerprint WHERE region = ?",
+                                    (region,)).fetchall()
+        return {name: (fingerprint, image_id) for name, fingerprint, image_id in rows}
+
+    def counts(self):
+        '''{state: number of ASGs} across all regions'''
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM asg_state GROUP BY state").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._db.close()
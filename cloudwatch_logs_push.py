@@ -1,27 +1,363 @@
-#!/usr/bin/env python3 
-import boto3
+#!/usr/bin/env python3
 import time
-from datetime import datetime
-import pprint
+import threading
+import logging
+import collections
+import concurrent.futures
+import json
+import sys
+
+from aws_clients import get_client
+
+logger = logging.getLogger(__name__)
 
 AWS_REGION = "us-west-2"
-client = boto3.client('logs', region_name=AWS_REGION)
 messages = ["Request Processed Successfully", "Request Failed",
             "Unknown Response", "Email Sent"]
 
-seq_token = None
-
-response = client.put_log_events(
-    logGroupName = 'bigid',
-    logStreamName = 'ApplicationLogs',
-    logEvents=[
-        {
-            'timestamp': int(time.time() * 1000),
-            'message': f'nothing to see here, kidding - just this line {time.time()}'
-        }
-    ]
-)
-
-print("Logs generated successfully")
-print("RESPONSE")
-pprint.pprint(response)
\ No newline at end of file
+# put_log_events service limits
+MAX_BATCH_EVENTS = 10000
+MAX_BATCH_BYTES = 1048576 # sum of UTF-8 message sizes plus EVENT_OVERHEAD per event
+EVENT_OVERHEAD = 26
+MAX_EVENT_BYTES = 262144 - EVENT_OVERHEAD # a single message, overhead excluded
+MAX_BATCH_SPAN_MS = 24 * 60 * 60 * 1000 # first to last event in one batch
+FLUSH_INTERVAL = 5.0 # seconds an event may wait in the buffer
+
+# what CloudWatchLogsHandler does when its queue is full
+BLOCK = "block" # caller waits for room
+DROP_OLDEST = "drop_oldest" # oldest queued event is discarded
+SPILL = "spill" # event is appended to a local JSON Lines file, see replay_spill()
+
+_flusher_state = threading.local() # .active is set on handler flusher threads
+
+
+def event_size(message):
+    '''Bytes an event counts for against MAX_BATCH_BYTES'''
+    return len(message.encode('utf-8')) + EVENT_OVERHEAD
+
+
+def split_batches(events):
+    '''Sort events by timestamp and cut them into put_log_events sized batches.
+
+    events is a list of {'timestamp': ms, 'message': str}; each batch respects the
+    10,000 event, 1 MB and 24 hour limits.
+    '''
+    batches = []
+    batch, batch_bytes = [], 0
+    for event in sorted(events, key=lambda e: e['timestamp']):
+        size = event_size(event['message'])
+        if batch and (len(batch) >= MAX_BATCH_EVENTS or batch_bytes + size > MAX_BATCH_BYTES
+                      or event['timestamp'] - batch[0]['timestamp'] > MAX_BATCH_SPAN_MS):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(event)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def rejected_count(info, batch_len):
+    '''Events of a batch (sorted by timestamp) that rejectedLogEventsInfo says were not stored.
+
+    Events before tooOldLogEventEndIndex or expiredLogEventEndIndex and from
+    tooNewLogEventStartIndex on are rejected; the ones in between were accepted.
+    '''
+    if not info:
+        return 0
+    first = max(info.get('tooOldLogEventEndIndex', 0), info.get('expiredLogEventEndIndex', 0))
+    end = min(info.get('tooNewLogEventStartIndex', batch_len), batch_len)
+    return batch_len - max(0, end - first)
+
+
+class LogShipper:
+    '''Buffers log events for one log group/stream and sends them with as few put_log_events calls as possible.
+
+    A flush happens when the buffer holds a full batch (by count or bytes), when
+    the oldest buffered event has waited flush_interval seconds, or on flush()/close().
+    The interval is kept by a timer armed when the buffer gets its first event,
+    so an idle shipper still flushes; with auto_flush=False the caller polls
+    flush_if_due() instead.
+    Events CloudWatch rejects (too old, too new, past retention) and empty
+    messages, which put() drops, count as events_rejected, not events_sent. Usable as a context manager, which flushes on exit.
+    '''
+    def __init__(self, log_group, log_stream, client=None, region=AWS_REGION, flush_interval=FLUSH_INTERVAL,
+                 auto_flush=True):
+        self.log_group = log_group
+        self.log_stream = log_stream
+        self.client = client or get_client('logs', region)
+        self.flush_interval = flush_interval
+        self.auto_flush = auto_flush
+        self.events_sent = 0
+        self.events_rejected = 0
+        self.batches_sent = 0
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._first_buffered = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def put(self, message, timestamp=None):
+        '''Buffer one event; timestamp is epoch milliseconds, default now'''
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        if not message: # put_log_events refuses the whole batch over one empty message
+            logger.warning("Dropping empty log event for %s/%s", self.log_group, self.log_stream)
+            with self._lock:
+                self.events_rejected += 1
+            return
+        encoded = message.encode('utf-8')
+        if len(encoded) > MAX_EVENT_BYTES:
+            logger.warning("Truncating %d byte log event to %d bytes", len(encoded), MAX_EVENT_BYTES)
+            message = encoded[:MAX_EVENT_BYTES].decode('utf-8', errors='ignore')
+        size = event_size(message)
+        with self._lock:
+            if self._buffer and (len(self._buffer) >= MAX_BATCH_EVENTS or self._buffer_bytes + size > MAX_BATCH_BYTES):
+                self._flush_locked()
+            if not self._buffer:
+                self._first_buffered = time.monotonic()
+                self._arm_locked()
+            self._buffer.append({'timestamp': int(timestamp), 'message': message})
+            self._buffer_bytes += size
+            if time.monotonic() - self._first_buffered >= self.flush_interval:
+                self._flush_locked()
+
+    def put_many(self, events):
+        '''Buffer (timestamp_ms, message) pairs'''
+        for timestamp, message in events:
+            self.put(message, timestamp)
+
+    def flush_if_due(self):
+        '''Flush when the oldest buffered event has waited flush_interval seconds'''
+        with self._lock:
+            if self._buffer and time.monotonic() - self._first_buffered >= self.flush_interval:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _arm_locked(self, delay=None):
+        '''Start the flush timer unless one is pending or the interval is infinite'''
+        if self._timer is not None or not self.auto_flush or self.flush_interval == float('inf'):
+            return
+        if delay is None:
+            delay = self._first_buffered + self.flush_interval - time.monotonic()
+        self._timer = threading.Timer(max(0.0, delay), self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            if not self._buffer:
+                return
+            if time.monotonic() - self._first_buffered >= self.flush_interval:
+                try:
+                    self._flush_locked()
+                except Exception as e: # events stay buffered, retried an interval later
+                    logger.warning("Timed flush to %s/%s failed: %s", self.log_group, self.log_stream, e)
+                    self._arm_locked(self.flush_interval)
+                    return
+            if self._buffer: # refilled since, or not yet due
+                self._arm_locked()
+
+    def _flush_locked(self):
+        events, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        batches = split_batches(events)
+        for i, batch in enumerate(batches):
+            try:
+                response = self.client.put_log_events(logGroupName=self.log_group, logStreamName=self.log_stream,
+                                                      logEvents=batch)
+            except Exception:
+                # keep what was not sent so a later flush can retry it
+                unsent = [e for b in batches[i:] for e in b]
+                self._buffer = unsent + self._buffer
+                self._buffer_bytes = sum(event_size(e['message']) for e in self._buffer)
+                raise
+            rejected = rejected_count(response.get('rejectedLogEventsInfo'), len(batch))
+            if rejected:
+                logger.warning("CloudWatch Logs rejected %d events in %s/%s: %s", rejected, self.log_group,
+                               self.log_stream, response['rejectedLogEventsInfo'])
+            self.events_sent += len(batch) - rejected
+            self.events_rejected += rejected
+            self.batches_sent += 1
+
+
+class CloudWatchLogsHandler(logging.Handler):
+    '''Non-blocking logging handler that ships records to CloudWatch Logs from a background thread.
+
+    emit() only formats the record and appends it to a bounded in-memory queue,
+    so callers never wait on the network. A flusher thread drains the queue
+    into one LogShipper per log stream and flushes the streams in parallel.
+    overflow picks what happens when the queue is full: BLOCK, DROP_OLDEST or
+    SPILL (to spill_file). stream_for(record) routes records to streams; by
+    default everything goes to log_stream. close() drains everything queued.
+    '''
+    def __init__(self, log_group, log_stream="ApplicationLogs", client=None, region=AWS_REGION,
+                 queue_size=10000, overflow=BLOCK, spill_file=None, flush_interval=FLUSH_INTERVAL,
+                 flush_workers=4, stream_for=None, level=logging.NOTSET):
+        super().__init__(level)
+        if overflow not in (BLOCK, DROP_OLDEST, SPILL):
+            raise ValueError(f"overflow must be one of {BLOCK}, {DROP_OLDEST}, {SPILL}")
+        if overflow == SPILL and not spill_file:
+            raise ValueError("overflow=SPILL needs a spill_file")
+        self.log_group = log_group
+        self.client = client or get_client('logs', region)
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.spill_file = spill_file
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.spilled = 0
+        self.accepted = 0 # records queued, including any dropped later
+        self.undrained = 0 # events still unsent when close() timed out
+        self._stream_for = stream_for or (lambda record: log_stream)
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._closed = False
+        self._shippers = {} # stream -> LogShipper, only touched by the flusher thread
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=flush_workers, thread_name_prefix="cwl-flush")
+        self._flusher = threading.Thread(target=self._run, name="cwl-flusher", daemon=True)
+        self._flusher.start()
+
+    def emit(self, record):
+        try:
+            item = (self._stream_for(record), int(record.created * 1000), self.format(record))
+            with self._cond:
+                if self._closed:
+                    return
+                if len(self._queue) >= self.queue_size:
+                    if self.overflow == BLOCK and not getattr(_flusher_state, 'active', False):
+                        # a flusher thread logging (e.g. a rejected batch) must never wait on itself
+                        while len(self._queue) >= self.queue_size and not self._closed:
+                            self._cond.wait()
+                    elif self.overflow in (BLOCK, DROP_OLDEST):
+                        self._queue.popleft()
+                        self.dropped += 1
+                    else:
+                        self._spill(item)
+                        return
+                self._queue.append(item)
+                self.accepted += 1
+                self._cond.notify_all()
+        except Exception:
+            self.handleError(record)
+
+    def _spill(self, item):
+        stream, timestamp, message = item
+        with self._spill_lock:
+            with open(self.spill_file, 'a') as f:
+                f.write(json.dumps({'stream': stream, 'timestamp': timestamp, 'message': message}) + "\n")
+            self.spilled += 1
+
+    def _run(self):
+        _flusher_state.active = True
+        while True:
+            with self._cond:
+                if not self._queue and not self._closed:
+                    self._cond.wait(self.flush_interval / 2)
+                items = list(self._queue)
+                self._queue.clear()
+                closing = self._closed
+                self._cond.notify_all() # room again for BLOCKed callers
+            self._ship(items, final=closing)
+            if closing:
+                self._pool.shutdown(wait=True) # only ever after the final drain, which still submits to it
+                return
+
+    def _ship(self, items, final=False):
+        by_stream = {}
+        for stream, timestamp, message in items:
+            by_stream.setdefault(stream, []).append((timestamp, message))
+        for stream in by_stream:
+            if stream not in self._shippers:
+                # no shipper timers - the flusher polls flush_if_due(), and only its threads may log into this handler
+                self._shippers[stream] = LogShipper(self.log_group, stream, self.client, flush_interval=self.flush_interval,
+                                                    auto_flush=False)
+
+        def ship(stream):
+            _flusher_state.active = True
+            shipper = self._shippers[stream]
+            shipper.put_many(by_stream.get(stream, ()))
+            if final:
+                shipper.flush()
+            else:
+                shipper.flush_if_due()
+        futures = {self._pool.submit(ship, stream): stream for stream in self._shippers}
+        for future, stream in futures.items():
+            try:
+                future.result()
+            except Exception as e: # unsent events stay in the shipper for the next round
+                # not logged through logging - this handler may be the one receiving it
+                sys.stderr.write(f"CloudWatchLogsHandler: flush of {self.log_group}/{stream} failed: {e}\n")
+
+    def flush(self):
+        '''Wait until everything queued so far has been handed to the shippers'''
+        with self._cond:
+            while self._queue and not self._closed:
+                self._cond.wait(0.1)
+
+    def close(self, timeout=30.0):
+        '''Stop accepting records and ship everything still queued or buffered, waiting up to timeout seconds.
+
+        The flusher releases the thread pool once its final drain is done. If
+        that takes longer than timeout it carries on in the background, and the
+        events not yet sent are reported on stderr and kept in self.undrained.
+        '''
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join(timeout)
+        if self._flusher.is_alive():
+            shipped = sum(s.events_sent + s.events_rejected for s in list(self._shippers.values()))
+            with self._cond:
+                self.undrained = self.accepted - self.dropped - shipped # a snapshot, shippers may be mid-flush
+            sys.stderr.write(f"CloudWatchLogsHandler: close timed out after {timeout}s with "
+                             f"{self.undrained} events of {self.log_group} not yet sent\n")
+        super().close()
+
+
+def replay_spill(spill_file, log_group, client=None, region=AWS_REGION):
+    '''Send the events a SPILL handler wrote to spill_file, returns the number sent'''
+    client = client or get_client('logs', region)
+    shippers = {}
+    sent = 0
+    with open(spill_file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            shipper = shippers.get(event['stream'])
+            if shipper is None:
+                shipper = shippers[event['stream']] = LogShipper(log_group, event['stream'], client, flush_interval=float('inf'))
+            shipper.put(event['message'], event['timestamp'])
+            sent += 1
+    for shipper in shippers.values():
+        shipper.close()
+    return sent
+
+
+if __name__ == "__main__":
+    client = get_client('logs', AWS_REGION)
+    with LogShipper('bigid', 'ApplicationLogs', client) as shipper:
+        shipper.put(f'nothing to see here, kidding - just this line {time.time()}')
+        for message in messages:
+            shipper.put(message)
+
+    print("Logs generated successfully")
+    print(f"Events: {shipper.events_sent}, put_log_events calls: {shipper.batches_sent}")
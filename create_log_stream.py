@@ -1,28 +1,31 @@
 #!/usr/bin/env python3
-import boto3
 import pprint
 import datetime
+import threading
+from botocore.exceptions import ClientError
+from aws_clients import get_client
 
 AWS_REGION = "us-west-2"
 
-def get_log_stream_names(client, logGroupName):
-    # return a list of log stream names from one log group
+def get_log_stream_names(client, logGroupName, prefix=None):
+    # return a list of log stream names from one log group, every page of them
+    # prefix narrows the listing server side, e.g. to a single day's stream
+    kwargs = {'logGroupName': logGroupName}
+    if prefix:
+        kwargs['logStreamNamePrefix'] = prefix
+    else:
+        kwargs.update(orderBy='LogStreamName', descending=True)
+    paginator = client.get_paginator('describe_log_streams')
     stream_names = []
-    try:
-        response = client.describe_log_streams(
-            logGroupName=logGroupName,
-            orderBy='LogStreamName',
-            descending=True,
-        )
-    except Exception as e:
-        raise(e)
-
-    log_stream_list = response['logStreams']
-    for stream in log_stream_list:
-        name = stream.get('logStreamName', 'Error')
-        stream_names.append(name)
+    for page in paginator.paginate(**kwargs):
+        for stream in page['logStreams']:
+            stream_names.append(stream.get('logStreamName', 'Error'))
     return stream_names
 
+def log_stream_exists(client, logGroupName, logStreamName):
+    # one prefix filtered lookup instead of listing the whole group
+    return logStreamName in get_log_stream_names(client, logGroupName, prefix=logStreamName)
+
 def get_todays_stream_name():
     # create a string representing today e.g.  2023-02-03
     today = datetime.datetime.now()
@@ -40,13 +43,51 @@ def create_log_stream(client, logGroupName, logStreamName):
         raise(e)
     return response
 
+def ensure_log_stream(client, logGroupName, logStreamName):
+    # create a log stream unless it exists, returns True if this call created it
+    if log_stream_exists(client, logGroupName, logStreamName):
+        return False
+    try:
+        create_log_stream(client, logGroupName, logStreamName)
+    except ClientError as e:
+        # someone else created it between the lookup and the create
+        if e.response['Error']['Code'] == 'ResourceAlreadyExistsException':
+            return False
+        raise
+    return True
+
+class StreamResolver:
+    '''Resolves today's stream name for a log group, creating the stream on first use.
+
+    Known streams are cached for the life of the process and the cache rolls
+    over when get_todays_stream_name() changes, so after the first call of
+    the day resolve() makes no API calls.
+    '''
+    def __init__(self, client=None, region=AWS_REGION):
+        self.client = client or get_client('logs', region)
+        self.api_lookups = 0
+        self._day = None
+        self._known = set() # log groups whose stream for self._day exists
+        self._lock = threading.Lock()
+
+    def resolve(self, logGroupName):
+        today = get_todays_stream_name()
+        if today == self._day and logGroupName in self._known:
+            return today
+        with self._lock:
+            if today != self._day:
+                self._day, self._known = today, set()
+            if logGroupName not in self._known:
+                self.api_lookups += 1
+                ensure_log_stream(self.client, logGroupName, today)
+                self._known.add(logGroupName)
+        return today
+
 if __name__ == "__main__":
-    client = boto3.client('logs', region_name=AWS_REGION)
-    stream_names = get_log_stream_names(client, 'bigid')
+    client = get_client('logs', AWS_REGION)
     today = get_todays_stream_name()
 
-    if today in stream_names:
-        print("found it, don't need to create it")
+    if ensure_log_stream(client, 'bigid', today):
+        print("not found, created it")
     else:
-        print("not found, creating it")
-        create_log_stream(client, 'bigid', today)
\ No newline at end of file
+        print("found it, don't need to create it")
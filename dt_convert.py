@@ -1,35 +1,246 @@
 #!/usr/bin/env python3
 #dt = "2023-01-26T19:59:35.389z"
-from datetime import datetime, timezone
- 
+import re
+import sys
+import time
+from array import array
+from datetime import datetime, date, timedelta, timezone
 
-def convert_time(bigid_str):
-    # expecting format like "2023-01-26T19:59:35.389z"
+try:
+    import numpy as np
+except ImportError:  # optional - convert_many falls back to array('q')
+    np = None
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+MS_PER_DAY = 86400000
+TIMESTAMP_LEN = len("2023-01-26T19:59:35.389z")
+MINUTE_CACHE_SIZE = 100000  # distinct minutes remembered per convert_many call
+CHUNK_SIZE = 65536  # lines per convert_many call in convert_file
+DIGIT_POSITIONS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18, 20, 21, 22]
+MONTH_DAYS = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+SEPARATORS = {4: '-', 7: '-', 10: 'T', 13: ':', 16: ':', 19: '.', 23: 'z'}
+# the "YYYY-MM-DDTHH:MM" prefix of the fixed layout, ASCII digits only - int() alone would also take signs and underscores
+MINUTE_PREFIX = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}")
+
+
+def _field(text):
+    # a timestamp field is plain ASCII digits; int() would also take signs, spaces and underscores
+    if not (text.isascii() and text.isdigit()):
+        raise ValueError(f"bad timestamp field {text!r}")
+    return int(text)
 
+
+def convert_time(bigid_str):
+    # expecting format like "2023-01-26T19:59:35.389z"; raises ValueError on anything else
+    if not bigid_str.endswith(('z', 'Z')):
+        raise ValueError(f"timestamp {bigid_str!r} does not end in z")
     bigid_str = bigid_str[:-1]
-    dt = bigid_str.split("T")
-    mydate = dt[0].split("-")
-    year = mydate[0]
-    month = mydate[1]
-    day = mydate[2]
-    mytime = dt[1].split(":")
-    hour = mytime[0]
-    minute = mytime[1]
-    s_ms = mytime[2].split('.')
-    second = s_ms[0]
-    millisecond = s_ms[1]
+    try:
+        dt = bigid_str.split("T")
+        mydate = dt[0].split("-")
+        year = mydate[0]
+        month = mydate[1]
+        day = mydate[2]
+        mytime = dt[1].split(":")
+        hour = mytime[0]
+        minute = mytime[1]
+        s_ms = mytime[2].split('.')
+        second = s_ms[0]
+        millisecond = s_ms[1]
+    except IndexError:
+        raise ValueError(f"unrecognised timestamp {bigid_str!r}z") from None
+    if len(dt) != 2 or len(mydate) != 3 or len(mytime) != 3 or len(s_ms) != 2:
+        raise ValueError(f"unrecognised timestamp {bigid_str!r}z")
     #print(f"{year, month, day, hour, minute, second, millisecond}")
-    actual = datetime(int(year), int(month), int(day), int(hour),
-                    int(minute), int(second), int(millisecond), tzinfo=timezone.utc)
+    # datetime wants microseconds, and the fraction may have fewer than 3 digits
+    microsecond = _field(millisecond.ljust(6, '0')[:6])
+    actual = datetime(_field(year), _field(month), _field(day), _field(hour),
+                    _field(minute), _field(second), microsecond, tzinfo=timezone.utc)
 
-    epoch =  datetime(1970, 1, 1, tzinfo=timezone.utc)
-    x = int((actual - epoch).total_seconds() * 1000)   
+    x = (actual - EPOCH) // timedelta(milliseconds=1)
     return x
 
+
+def _iter_epoch_ms(strings):
+    # fixed-offset slicing, with the date/hour/minute part memoized since exported
+    # timestamps arrive in bursts; anything off the fixed layout goes through convert_time
+    # the ":SS.mmmz" tail is checked per string, the minute prefix only when it is not cached yet
+    minutes = {}
+    for s in strings:
+        if (len(s) != TIMESTAMP_LEN or s[16] != ':' or s[19] != '.' or s[23] != 'z' or not s.isascii()
+                or not s[17:19].isdigit() or not s[20:23].isdigit()):
+            yield convert_time(s)
+            continue
+        base = minutes.get(s[:16])
+        if base is None:
+            if not MINUTE_PREFIX.fullmatch(s, 0, 16):
+                yield convert_time(s)
+                continue
+            hour, minute = int(s[11:13]), int(s[14:16])
+            if hour > 23 or minute > 59:
+                yield convert_time(s)  # raises ValueError, as datetime does
+                continue
+            if len(minutes) >= MINUTE_CACHE_SIZE:
+                minutes.clear()
+            days = date(int(s[0:4]), int(s[5:7]), int(s[8:10])).toordinal() - EPOCH_ORDINAL
+            base = minutes[s[:16]] = days * MS_PER_DAY + hour * 3600000 + minute * 60000
+        second = int(s[17:19])
+        if second > 59:
+            yield convert_time(s)
+            continue
+        yield base + second * 1000 + int(s[20:23])
+
+
+def _days_from_civil(y, m, d):
+    # proleptic Gregorian date -> days since 1970-01-01, integer arithmetic only
+    # (works element-wise on NumPy arrays)
+    y = y - (m <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    mp = (m + 9) % 12
+    doy = (153 * mp + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def _numpy_epoch_ms(strings):
+    # parse every string at once from its UTF-32 code points; None if any string is off
+    # layout or not a valid date and time, so the caller falls back to the checked path
+    chars = np.asarray(strings, dtype=str)
+    if chars.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    if chars.dtype.itemsize != 4 * TIMESTAMP_LEN or np.char.str_len(chars).min() != TIMESTAMP_LEN:
+        return None
+    codes = chars.view(np.uint32).reshape(-1, TIMESTAMP_LEN).astype(np.int64)
+    for position, separator in SEPARATORS.items():
+        if (codes[:, position] != ord(separator)).any():
+            return None
+    digits = codes - ord('0')
+    if (digits[:, DIGIT_POSITIONS] < 0).any() or (digits[:, DIGIT_POSITIONS] > 9).any():
+        return None
+
+    def field(start, end):
+        value = np.zeros(len(digits), dtype=np.int64)
+        for i in range(start, end):
+            value = value * 10 + digits[:, i]
+        return value
+    year, month, day = field(0, 4), field(5, 7), field(8, 10)
+    hour, minute, second = field(11, 13), field(14, 16), field(17, 19)
+    if ((year < 1) | (month < 1) | (month > 12) | (hour > 23) | (minute > 59) | (second > 59)).any():
+        return None
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    if ((day < 1) | (day > np.array(MONTH_DAYS)[month - 1] + ((month == 2) & leap))).any():
+        return None
+    days = _days_from_civil(year, month, day)
+    return (days * MS_PER_DAY + hour * 3600000 + minute * 60000
+            + second * 1000 + field(20, 23))
+
+
+def convert_many(strings, use_numpy=False):
+    # bulk convert_time: epoch milliseconds for every string, as array('q')
+    # or, with use_numpy, a NumPy int64 array
+    if use_numpy:
+        if np is None:
+            raise RuntimeError("use_numpy needs numpy installed")
+        if not isinstance(strings, (list, tuple)) and not hasattr(strings, 'dtype'):
+            strings = list(strings)
+        result = _numpy_epoch_ms(strings)
+        if result is None:
+            result = np.fromiter(_iter_epoch_ms(strings), dtype=np.int64, count=len(strings))
+        return result
+    return array('q', _iter_epoch_ms(strings))
+
+
+def convert_file(src, dst, use_numpy=False):
+    # stream one timestamp per line from src to one epoch ms per line in dst,
+    # CHUNK_SIZE lines at a time; blank lines are skipped. Returns the line count.
+    count = 0
+    with open(src) as fin, open(dst, 'w') as fout:
+        chunk = []
+        for line in fin:
+            line = line.strip()
+            if line:
+                chunk.append(line)
+            if len(chunk) >= CHUNK_SIZE:
+                count += _write_chunk(fout, chunk, use_numpy)
+                chunk = []
+        if chunk:
+            count += _write_chunk(fout, chunk, use_numpy)
+    return count
+
+
+def _write_chunk(fout, chunk, use_numpy):
+    values = convert_many(chunk, use_numpy)
+    fout.write("\n".join(map(str, values.tolist())))
+    fout.write("\n")
+    return len(chunk)
+
+
+def benchmark(n=1000000):
+    # convert_time one string at a time vs convert_many, on n timestamps a few ms apart
+    start_ms = convert_time("2023-01-26T19:59:35.389z")
+    strings = [datetime.fromtimestamp((start_ms + i * 7) / 1000, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:23] + "z"
+               for i in range(n)]
+    runs = [("convert_time loop", lambda: [convert_time(s) for s in strings]),
+            ("convert_many", lambda: convert_many(strings))]
+    if np is not None:
+        runs.append(("convert_many numpy", lambda: convert_many(strings, use_numpy=True)))
+    expected = None
+    for name, fn in runs:
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        result = list(result)
+        expected = expected or result
+        assert result == expected, f"{name} disagrees with convert_time"
+        print(f"{name:<20} {elapsed:8.3f} s  {n / elapsed:>12,.0f} /s")
+
+
+MALFORMED = ["2023-01-26T-1:59:35.389z", "2023-01-26T19:59:-5.389z", "2023-01-26T19:59:35.-89z",
+             "2023-01-26T19:59:35.1_0z", "2023/01/26T19:59:35.389z", "2023-01-26T19:59:35.389x",
+             "2023-01-26T19:59:35.38az", "2023-02-31T19:59:35.389z", "2023-01-26T24:59:35.389z",
+             "+023-01-26T19:59:35.389z", "2023-01-26 19:59:35.389z", "2023-01-26T19:59:35z", ""]
+
+
+def check():
+    # every backend must raise ValueError on each MALFORMED string, alone or amid valid ones
+    valid = ["2023-01-26T19:59:35.389z", "2024-02-29T23:59:59.999z"]
+    backends = [("convert_time", lambda strings: [convert_time(s) for s in strings]),
+                ("convert_many", convert_many)]
+    if np is not None:
+        backends.append(("convert_many numpy", lambda strings: convert_many(strings, use_numpy=True)))
+    expected = [convert_time(s) for s in valid]
+    failures = 0
+    for name, fn in backends:
+        if list(fn(valid)) != expected:
+            print(f"{name}: wrong result for valid timestamps")
+            failures += 1
+        for bad in MALFORMED:
+            try:
+                result = fn(valid + [bad])
+            except ValueError:
+                continue
+            print(f"{name}: accepted {bad!r} as {list(result)[-1]}")
+            failures += 1
+    print(f"{len(backends)} backends, {len(MALFORMED)} malformed timestamps, {failures} failures")
+    return failures
+
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "check":
+        sys.exit(1 if check() else 0)
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+        sys.exit(0)
+    if len(sys.argv) > 2:
+        # dt_convert.py <timestamps file> <epoch ms file>
+        print(f"Converted {convert_file(sys.argv[1], sys.argv[2])} timestamps")
+        sys.exit(0)
+
     mydt = "2023-01-26T19:59:36.389z"
     print(f"Original: {mydt}")
     x = convert_time(mydt)
     print(x)
 
-    # note: in CloudWatch Logs console, the UI will show the timestamp with a +/- to show the local time zone
\ No newline at end of file
+    # note: in CloudWatch Logs console, the UI will show the timestamp with a +/- to show the local time zone
@@ -1,13 +1,70 @@
 #!/usr/bin/env python3
-import boto3
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from aws_clients import new_resource
+from batch import batched
 
 
 TABLE_NAME = "audit_log"
+AWS_REGION = "us-west-2"
+KEY_NAME = "timestamp"
+WRITE_BATCH_SIZE = 25 # BatchWriteItem limit, batch_writer sends at most this many
+GET_BATCH_SIZE = 100 # BatchGetItem limit
+MAX_UNPROCESSED_RETRIES = 8
+BASE_DELAY = 0.05 # seconds, doubled per retry of unprocessed keys (full jitter)
+LATEST_TTL = 2.0 # seconds LatestCache serves the marker before reading it again
+
+# boto3 resources are not thread-safe, so every thread keeps its own long-lived handles
+_local = threading.local()
+
+def get_resource(region=AWS_REGION):
+    # this thread's dynamodb service resource for region
+    resources = getattr(_local, 'resources', None)
+    if resources is None:
+        resources = _local.resources = {}
+    if region not in resources:
+        resources[region] = new_resource('dynamodb', region)
+    return resources[region]
+
+def get_table(table_name=TABLE_NAME, region=AWS_REGION):
+    # reuse this thread's Table for table_name instead of building a resource per call
+    tables = getattr(_local, 'tables', None)
+    if tables is None:
+        tables = _local.tables = {}
+    table = tables.get((table_name, region))
+    if table is None:
+        table = tables[(table_name, region)] = get_resource(region).Table(table_name)
+    return table
 
-def put_latest(table, value):
-    table.put_item(
-        Item = {'timestamp': 'latest', 'date_time': value}
-    )
+def put_latest(table, value, only_if_newer=False):
+    # only_if_newer makes the write conditional on value sorting after the stored
+    # date_time, so a slow writer cannot move the marker backwards; returns False
+    # when that condition rejected the write. latest_cache is invalidated either
+    # way, so pollers in this process read the new marker instead of waiting out the TTL
+    try:
+        return _write_latest(table, value, only_if_newer)
+    finally:
+        latest_cache.invalidate()
+
+def _write_latest(table, value, only_if_newer):
+    kwargs = {}
+    if only_if_newer:
+        kwargs = {'ConditionExpression': 'attribute_not_exists(date_time) OR date_time < :v',
+                  'ExpressionAttributeValues': {':v': value}}
+    try:
+        table.put_item(
+            Item = {'timestamp': 'latest', 'date_time': value},
+            **kwargs
+        )
+    except ClientError as e:
+        if only_if_newer and e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
 
 def get_latest(table):
     resp = table.get_item(
@@ -15,17 +72,109 @@ def get_latest(table):
             )
     return resp
 
+def put_audit_records(table, items):
+    # write any number of items with BatchWriteItem, 25 per request; batch_writer
+    # resends unprocessed items and keeps the last write of a repeated key
+    count = 0
+    with table.batch_writer(overwrite_by_pkeys=[KEY_NAME]) as writer:
+        for item in items:
+            writer.put_item(Item=item)
+            count += 1
+    return count
+
+def get_audit_records(table, keys, consistent=False, dynamodb=None):
+    # read many items with BatchGetItem, 100 keys per request, retrying unprocessed keys
+    # with backoff; returns {key value: item}, keys that do not exist are left out
+    dynamodb = dynamodb or get_resource(table.meta.client.meta.region_name)
+    found = {}
+    # BatchGetItem rejects a request naming the same key twice; keys may be values or key dicts
+    unique = dict.fromkeys(tuple(sorted(k.items())) if isinstance(k, dict) else ((KEY_NAME, k),) for k in keys)
+    for chunk in batched((dict(k) for k in unique), GET_BATCH_SIZE):
+        request = {table.name: {'Keys': chunk, 'ConsistentRead': consistent}}
+        for attempt in range(MAX_UNPROCESSED_RETRIES + 1):
+            resp = dynamodb.batch_get_item(RequestItems=request)
+            for item in resp['Responses'].get(table.name, []):
+                found[item[KEY_NAME]] = item
+            request = resp.get('UnprocessedKeys') or {}
+            if not request:
+                break
+            if attempt == MAX_UNPROCESSED_RETRIES:
+                raise RuntimeError(f"{len(request[table.name]['Keys'])} keys still unprocessed by BatchGetItem")
+            time.sleep(random.uniform(0, BASE_DELAY * 2 ** attempt))
+    return found
+
+class LatestCache:
+    '''Read-through cache of the 'latest' marker, so pollers share one get_item per ttl seconds.
+
+    Concurrent get() calls on an expired entry wait for a single read instead of
+    each issuing one. put() writes through: the cache holds the value just
+    written, or is dropped when a conditional write loses to a newer marker.
+    table defaults to this thread's get_table().
+    '''
+    def __init__(self, table=None, ttl=LATEST_TTL):
+        self.table = table
+        self.ttl = ttl
+        self.reads = 0
+        self._resp = None
+        self._expires = 0.0
+        self._generation = 0 # bumped by put() so an older read cannot overwrite a newer write
+        self._inflight = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        # same shape as get_latest()
+        while True:
+            with self._lock:
+                if self._resp is not None and time.monotonic() < self._expires:
+                    return self._resp
+                event = self._inflight
+                if event is None:
+                    event = self._inflight = threading.Event()
+                    generation = self._generation
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                event.wait()
+                continue
+            try:
+                resp = get_latest(self.table or get_table())
+                with self._lock:
+                    self.reads += 1
+                    if generation == self._generation:
+                        self._store(resp)
+                return resp
+            finally:
+                with self._lock:
+                    self._inflight = None
+                event.set()
+
+    def put(self, value, only_if_newer=False):
+        written = _write_latest(self.table or get_table(), value, only_if_newer)
+        with self._lock:
+            self._generation += 1
+            if written:
+                self._store({'Item': {'timestamp': 'latest', 'date_time': value}})
+            else:
+                self._resp = None
+        return written
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._resp = None
+
+    def _store(self, resp):
+        self._resp = resp
+        self._expires = time.monotonic() + self.ttl
+
+latest_cache = LatestCache() # process wide, shared by every poller thread
+
 if __name__ == "__main__":
     # get a connection to dynamodb
-    dynamodb = boto3.resource('dynamodb', region_name='us-west-2')
-
     # push our data into the table
-    table = dynamodb.Table('audit_log')
+    table = get_table(TABLE_NAME)
     put_latest(table, '12345679')
 
     response = get_latest(table)
     print(response['Item'])
-
-
-
-
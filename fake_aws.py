@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+'''In-process stand-in for the ec2 and autoscaling APIs the ASG tools use - for offline benchmarks'''
+import threading
+import time
+from botocore.exceptions import ClientError
+
+from aws_throttle import TokenBucket
+
+
+class FakeFleet:
+    '''Shared account state: N ASGs spread over M launch templates whose versions use K AMIs.
+
+    Every call sleeps latency seconds. With throttle_rate set, calls beyond that
+    many per second (per service) fail with the service's throttling error, as
+    the real APIs do.
+    '''
+    def __init__(self, n_asgs=1000, n_templates=100, n_amis=10, latency=0.0, throttle_rate=None,
+                 region="us-west-2"):
+        self.region = region
+        self.latency = latency
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.buckets = {}
+        if throttle_rate:
+            for service in ('ec2', 'autoscaling'):
+                self.buckets[service] = TokenBucket(throttle_rate)
+        self.templates = {} # name -> {'default': n, 'versions': {n: LaunchTemplateData}}
+        self.client_tokens = {} # ClientToken -> version number it created
+        for t in range(n_templates):
+            data = {'ImageId': f"ami-{t % n_amis:017x}",
+                    'TagSpecifications': [{'ResourceType': 'instance', 'Tags': [{'Key': 'team', 'Value': f"t{t}"}]}]}
+            self.templates[f"lt-{t}"] = {'default': 1, 'versions': {1: data}}
+        self.images = {f"ami-{k:017x}": {'ImageId': f"ami-{k:017x}", 'ImageLocation': f"amazon/golden-{k}",
+                                          'Name': f"golden-{k}", 'OwnerId': "137112412989"} for k in range(n_amis)}
+        versions = ["1", "$Default", "$Latest"]
+        self.groups = [{'AutoScalingGroupName': f"asg-{i}",
+                        'LaunchTemplate': {'LaunchTemplateName': f"lt-{i % n_templates}", 'Version': versions[i % 3]},
+                        'AvailabilityZones': [f"{region}a"]}
+                       for i in range(n_asgs)]
+
+    def clients(self):
+        return FakeClient(self, 'ec2'), FakeClient(self, 'autoscaling')
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def _enter(self, service, operation):
+        bucket = self.buckets.get(service)
+        if bucket is not None and not bucket.try_acquire():
+            with self.lock:
+                self.calls['throttled'] = self.calls.get('throttled', 0) + 1
+            code = 'RequestLimitExceeded' if service == 'ec2' else 'Throttling'
+            raise ClientError({'Error': {'Code': code, 'Message': "Rate exceeded"}}, operation)
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _version(self, name, version):
+        template = self.templates[name]
+        if version == '$Default':
+            return template['default']
+        if version == '$Latest':
+            return max(template['versions'])
+        return int(version)
+
+    # --- operations, named as in botocore's service models ---
+    def DescribeAutoScalingGroups(self, AutoScalingGroupNames=None, MaxRecords=50, NextToken=None):
+        groups = self.groups
+        if AutoScalingGroupNames:
+            groups = [g for g in groups if g['AutoScalingGroupName'] in AutoScalingGroupNames]
+        start = int(NextToken or 0)
+        page = {'AutoScalingGroups': [dict(g) for g in groups[start:start + MaxRecords]]}
+        if start + MaxRecords < len(groups):
+            page['NextToken'] = str(start + MaxRecords)
+        return page
+
+    def UpdateAutoScalingGroup(self, AutoScalingGroupName, LaunchTemplate):
+        with self.lock:
+            for g in self.groups:
+                if g['AutoScalingGroupName'] == AutoScalingGroupName:
+                    g['LaunchTemplate'] = dict(LaunchTemplate)
+        return {}
+
+    def DescribeLaunchTemplates(self, LaunchTemplateNames=None, MaxResults=None, NextToken=None):
+        out = []
+        for name in LaunchTemplateNames or sorted(self.templates):
+            if name not in self.templates:
+                raise ClientError({'Error': {'Code': 'InvalidLaunchTemplateName.NotFoundException',
+                                             'Message': name}}, 'DescribeLaunchTemplates')
+            t = self.templates[name]
+            out.append({'LaunchTemplateName': name, 'DefaultVersionNumber': t['default'],
+                        'LatestVersionNumber': max(t['versions'])})
+        return {'LaunchTemplates': out}
+
+    def DescribeLaunchTemplateVersions(self, LaunchTemplateName, Versions):
+        t = self.templates[LaunchTemplateName]
+        out = []
+        for v in Versions:
+            n = self._version(LaunchTemplateName, v)
+            out.append({'LaunchTemplateName': LaunchTemplateName, 'VersionNumber': n,
+                        'DefaultVersion': n == t['default'], 'LaunchTemplateData': t['versions'][n]})
+        return {'LaunchTemplateVersions': out}
+
+    def CreateLaunchTemplateVersion(self, LaunchTemplateName, SourceVersion, LaunchTemplateData, ClientToken=None):
+        with self.lock:
+            if ClientToken is not None and ClientToken in self.client_tokens: # idempotent, like EC2
+                return {'LaunchTemplateVersion': {'LaunchTemplateName': LaunchTemplateName,
+                                                  'VersionNumber': self.client_tokens[ClientToken]}}
+            t = self.templates[LaunchTemplateName]
+            data = dict(t['versions'][int(SourceVersion)])
+            data.update(LaunchTemplateData)
+            n = max(t['versions']) + 1
+            t['versions'][n] = data
+            if ClientToken is not None:
+                self.client_tokens[ClientToken] = n
+        return {'LaunchTemplateVersion': {'LaunchTemplateName': LaunchTemplateName, 'VersionNumber': n}}
+
+    def ModifyLaunchTemplate(self, LaunchTemplateName, DefaultVersion, DryRun=False):
+        with self.lock:
+            self.templates[LaunchTemplateName]['default'] = int(DefaultVersion)
+        return {}
+
+    def DescribeImages(self, ImageIds):
+        return {'Images': [dict(self.images[i]) for i in ImageIds if i in self.images]}
+
+
+_OPERATIONS = {
+    'autoscaling': {'describe_auto_scaling_groups': 'DescribeAutoScalingGroups',
+                    'update_auto_scaling_group': 'UpdateAutoScalingGroup'},
+    'ec2': {'describe_launch_templates': 'DescribeLaunchTemplates',
+            'describe_launch_template_versions': 'DescribeLaunchTemplateVersions',
+            'create_launch_template_version': 'CreateLaunchTemplateVersion',
+            'modify_launch_template': 'ModifyLaunchTemplate',
+            'describe_images': 'DescribeImages'},
+}
+_PAGINATION = {'describe_auto_scaling_groups': ('MaxRecords', 'AutoScalingGroups'),
+               'describe_launch_templates': ('MaxResults', 'LaunchTemplates')}
+
+
+class _Meta:
+    def __init__(self, service, region):
+        self.region_name = region
+        self.service_model = type('ServiceModel', (), {'service_name': service})()
+
+
+class _Paginator:
+    def __init__(self, client, method):
+        self._client = client
+        self._method = method
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        size_key, _ = _PAGINATION[self._method]
+        kwargs[size_key] = (PaginationConfig or {}).get('PageSize', 50)
+        while True:
+            page = getattr(self._client, self._method)(**kwargs)
+            yield page
+            if not page.get('NextToken'):
+                return
+            kwargs['NextToken'] = page['NextToken']
+
+
+class FakeClient:
+    '''Looks enough like a boto3 client for aws_throttle.govern and the ASG helpers'''
+    def __init__(self, fleet, service):
+        self._fleet = fleet
+        self.meta = _Meta(service, fleet.region)
+
+    def _make_api_call(self, operation_name, api_params):
+        self._fleet._enter(self.meta.service_model.service_name, operation_name)
+        return getattr(self._fleet, operation_name)(**api_params)
+
+    def get_paginator(self, method):
+        return _Paginator(self, method)
+
+    def __getattr__(self, method):
+        operation = _OPERATIONS[self.meta.service_model.service_name].get(method)
+        if operation is None:
+            raise AttributeError(method)
+        return lambda **kwargs: self._make_api_call(operation, kwargs)
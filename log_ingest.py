@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+'''Streaming ingestion of exported log files into CloudWatch Logs - one daily stream per event date'''
+import argparse
+import collections
+import logging
+import time
+
+import dt_convert
+from aws_clients import get_client
+from batch import batched
+from cloudwatch_logs_push import AWS_REGION, LogShipper
+from create_log_stream import ensure_log_stream
+
+logger = logging.getLogger(__name__)
+
+CHUNK_LINES = 10000 # lines parsed per dt_convert.convert_many call
+MAX_OPEN_STREAMS = 4 # daily streams buffering at once, the least recently used is flushed past this
+STREAM_NAME_LEN = len("2023-02-03") # get_todays_stream_name() layout, the date part of an exported timestamp
+
+
+def iter_lines(path, encoding='utf-8'):
+    '''Yield the lines of path without their line endings, one buffered read at a time'''
+    with open(path, 'rb') as f:
+        for raw in f:
+            line = raw.rstrip(b"\r\n")
+            if line:
+                yield line.decode(encoding, errors='replace')
+
+
+def split_line(line):
+    '''Default line layout: "2023-01-26T19:59:35.389z message text"'''
+    timestamp, _, message = line.partition(" ")
+    return timestamp, message
+
+
+def convert_chunk(timestamps):
+    '''Epoch milliseconds for each timestamp, None where it does not parse'''
+    try:
+        return list(dt_convert.convert_many(timestamps))
+    except (ValueError, IndexError):
+        pass
+    result = []
+    for timestamp in timestamps:
+        try:
+            result.append(dt_convert.convert_time(timestamp))
+        except (ValueError, IndexError):
+            result.append(None)
+    return result
+
+
+class Ingestor:
+    '''Pushes parsed log lines to daily streams of one log group.
+
+    Each event goes to the stream named after its UTC date, created on first
+    use. Only MAX_OPEN_STREAMS LogShippers buffer at once, so memory stays
+    bounded by that many 1 MB batches however large the input is.
+    '''
+    def __init__(self, log_group, client=None, region=AWS_REGION, create_streams=True, line_parser=split_line):
+        self.log_group = log_group
+        self.client = client or get_client('logs', region)
+        self.create_streams = create_streams
+        self.line_parser = line_parser
+        self.events = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+        self._ensured = set()
+        self._shippers = collections.OrderedDict() # stream -> LogShipper, least recently used first
+        self._closed_shippers = [] # (events_sent, batches_sent, events_rejected) of shippers already flushed and dropped
+
+    def _shipper(self, stream):
+        shipper = self._shippers.get(stream)
+        if shipper is not None:
+            self._shippers.move_to_end(stream)
+            return shipper
+        if self.create_streams and stream not in self._ensured:
+            ensure_log_stream(self.client, self.log_group, stream)
+            self._ensured.add(stream)
+        if len(self._shippers) >= MAX_OPEN_STREAMS:
+            _, oldest = self._shippers.popitem(last=False)
+            self._retire(oldest)
+        shipper = self._shippers[stream] = LogShipper(self.log_group, stream, self.client, flush_interval=float('inf'))
+        return shipper
+
+    def _retire(self, shipper):
+        shipper.close()
+        self._closed_shippers.append((shipper.events_sent, shipper.batches_sent, shipper.events_rejected))
+
+    def ingest_lines(self, lines):
+        start = time.perf_counter()
+        try:
+            for chunk in batched(lines, CHUNK_LINES):
+                parsed = [self.line_parser(line) for line in chunk]
+                for (timestamp, message), epoch_ms in zip(parsed, convert_chunk([p[0] for p in parsed])):
+                    if epoch_ms is None or not message: # put_log_events refuses empty messages
+                        self.skipped += 1
+                        continue
+                    self._shipper(timestamp[:STREAM_NAME_LEN]).put(message, epoch_ms)
+                    self.events += 1
+                    self.bytes += len(message)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def ingest_file(self, path):
+        self.ingest_lines(iter_lines(path))
+
+    def close(self):
+        start = time.perf_counter()
+        while self._shippers:
+            _, shipper = self._shippers.popitem(last=False)
+            self._retire(shipper)
+        self.elapsed += time.perf_counter() - start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        shippers = self._closed_shippers + [(s.events_sent, s.batches_sent, s.events_rejected) for s in self._shippers.values()]
+        return {'events': self.events, 'skipped': self.skipped, 'bytes': self.bytes,
+                'streams': len(self._ensured) if self.create_streams else None,
+                'put_log_events_calls': sum(b for _, b, _ in shippers), 'events_sent': sum(e for e, _, _ in shippers),
+                'events_rejected': sum(r for _, _, r in shippers),
+                'seconds': round(self.elapsed, 3),
+                'events_per_second': round(self.events / self.elapsed) if self.elapsed else None}
+
+
+def ingest(log_group, paths, client=None, region=AWS_REGION, create_streams=True):
+    '''Ship every file in paths to log_group and return the run's stats'''
+    with Ingestor(log_group, client, region, create_streams) as ingestor:
+        for path in paths:
+            ingestor.ingest_file(path)
+    return ingestor.stats()
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("files", help="Exported log files, one '<timestamp> <message>' per line", nargs='+')
+    argParser.add_argument("-g", "--log_group", help="Log group to push to", default="bigid")
+    argParser.add_argument("-r", "--region", help="AWS region", default=AWS_REGION)
+    argParser.add_argument("--no_create", help="Daily streams already exist, do not check or create them", action='store_true')
+    args = argParser.parse_args()
+
+    stats = ingest(args.log_group, args.files, region=args.region, create_streams=not args.no_create)
+    print(f"{stats['events']} events ({stats['skipped']} skipped) in {stats['seconds']} s: "
+          f"{stats['events_per_second']} events/s, {stats['put_log_events_calls']} put_log_events calls")
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+'''Launch template catalogue - batched prefetch and memoized lookups of launch template versions'''
+import threading
+import logging
+import hashlib
+import json
+import concurrent.futures
+from botocore.exceptions import ClientError
+
+from batch import batched
+from records import LaunchTemplateVersion
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_BATCH_SIZE = 100 # names per describe_launch_templates call
+VERSION_BATCH_SIZE = 100 # version numbers per describe_launch_template_versions call
+PREFETCH_WORKERS = 8 # templates whose versions are fetched at once
+NOT_FOUND_CODE = 'InvalidLaunchTemplateName.NotFoundException'
+
+
+def _region(ec2_client):
+    return ec2_client.meta.region_name
+
+
+def client_token(template_name, source_version, lt_data):
+    '''Idempotency token for create_launch_template_version, the same for the same template, source version and data.
+
+    aws_throttle retries the call after timeouts and transient errors; with the
+    token EC2 answers a retry of a request that already landed with the version
+    it created instead of adding a duplicate.
+    '''
+    payload = json.dumps([template_name, str(source_version), lt_data], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest() # 64 characters, the limit is 128
+
+
+class LaunchTemplateCatalog:
+    '''Thread-safe cache of launch templates and their versions, keyed by region.
+
+    Template versions never change once created, so they are memoized by
+    (region, template name, version number). $Default and $Latest are resolved
+    locally from each template's DefaultVersionNumber/LatestVersionNumber, which
+    are kept current through note_new_version()/note_default_version() when
+    this process creates or promotes a version. Versions are held as
+    records.LaunchTemplateVersion, not as the response entries.
+    '''
+    def __init__(self):
+        self.api_calls = 0
+        self._templates = {} # (region, name) -> describe_launch_templates entry
+        self._aliases = {} # (region, name) -> {'$Default': n, '$Latest': n}
+        self._versions = {} # (region, name, n) -> records.LaunchTemplateVersion
+        self._inflight = {} # key of a prefetch in progress -> threading.Event
+        self._lock = threading.Lock()
+
+    def _claim(self, keys, cache):
+        '''Mark the keys missing from cache and not already being fetched as in flight; returns them'''
+        with self._lock:
+            claimed = [k for k in keys if k not in cache and k not in self._inflight]
+            for key in claimed:
+                self._inflight[key] = threading.Event()
+        return claimed
+
+    def _release(self, keys):
+        with self._lock:
+            for key in keys:
+                event = self._inflight.pop(key, None)
+                if event:
+                    event.set()
+
+    def _wait(self, key):
+        '''Block while a prefetch is fetching key, so callers reuse its result instead of repeating the call'''
+        with self._lock:
+            event = self._inflight.get(key)
+        if event:
+            event.wait()
+
+    def _count_call(self):
+        with self._lock:
+            self.api_calls += 1
+
+    def _set_alias(self, key, alias, number, overwrite=False):
+        with self._lock:
+            aliases = self._aliases.setdefault(key, {})
+            if overwrite or alias not in aliases:
+                aliases[alias] = int(number)
+
+    def resolve(self, region, template_name, version):
+        '''Return the version number version refers to, or None if not known locally'''
+        version = str(version)
+        if version.isdigit():
+            return int(version)
+        with self._lock:
+            return self._aliases.get((region, template_name), {}).get(version)
+
+    def prefetch(self, ec2_client, refs):
+        '''Load every (template_name, version) in refs with as few API calls as possible.
+
+        Unknown templates are described in batches, then each template's missing
+        versions are fetched together in one describe_launch_template_versions call.
+        '''
+        region = _region(ec2_client)
+        refs = {(name, str(version)) for name, version in refs}
+        self.prefetch_templates(ec2_client, {name for name, _ in refs})
+
+        wanted = {}
+        for name, version in refs:
+            self._wait((region, name)) # another page's prefetch may still be describing the template
+            number = self.resolve(region, name, version)
+            if number is not None: # None - template not found
+                wanted.setdefault(name, set()).add((region, name, number))
+        claimed = {name: sorted(self._claim(sorted(keys), self._versions)) for name, keys in wanted.items()}
+        claimed = {name: keys for name, keys in claimed.items() if keys}
+
+        def fetch(name):
+            keys = claimed[name]
+            try:
+                for chunk in batched((str(k[2]) for k in keys), VERSION_BATCH_SIZE):
+                    self._describe_versions(ec2_client, name, chunk)
+            finally:
+                self._release(keys)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as pool:
+                for future in [pool.submit(fetch, name) for name in sorted(claimed)]:
+                    future.result()
+        finally:
+            self._release([k for keys in claimed.values() for k in keys])
+        return sum(len(keys) for keys in claimed.values())
+
+    def prefetch_templates(self, ec2_client, names):
+        '''Describe the templates in names not yet known, in batches - enough to resolve $Default and $Latest'''
+        region = _region(ec2_client)
+        keys = self._claim(sorted({(region, name) for name in names}), self._templates)
+        try:
+            for chunk in batched((name for _, name in keys), TEMPLATE_BATCH_SIZE):
+                self._describe_templates(ec2_client, chunk)
+        finally:
+            self._release(keys)
+        return len(keys)
+
+    def template(self, ec2_client, template_name):
+        '''Return the describe_launch_templates entry for a template, or None if it does not exist'''
+        key = (_region(ec2_client), template_name)
+        self._wait(key)
+        with self._lock:
+            if key in self._templates:
+                return self._templates[key]
+        self._describe_templates(ec2_client, [template_name])
+        with self._lock:
+            return self._templates.get(key)
+
+    def version(self, ec2_client, template_name, version):
+        '''Return the records.LaunchTemplateVersion version (a number, $Default or $Latest) refers to'''
+        region = _region(ec2_client)
+        self._wait((region, template_name))
+        number = self.resolve(region, template_name, version)
+        if number is not None:
+            self._wait((region, template_name, number))
+            with self._lock:
+                record = self._versions.get((region, template_name, number))
+            if record is not None:
+                return record
+        record = self._describe_versions(ec2_client, template_name, [str(number if number is not None else version)])[0]
+        if str(version) == '$Latest':
+            self._set_alias((region, template_name), '$Latest', record.version_number)
+        return record
+
+    def describe(self, ec2_client, template_name, version):
+        '''Return a describe_launch_template_versions shaped response for one version, with the fields kept'''
+        return self.version(ec2_client, template_name, version).as_response()
+
+    def image_ids(self, ec2_client, refs):
+        '''Return the distinct ImageIds used by the cached versions in refs'''
+        region = _region(ec2_client)
+        ids = set()
+        for name, version in refs:
+            number = self.resolve(region, name, version)
+            with self._lock:
+                record = self._versions.get((region, name, number))
+            if record is not None and record.image_id:
+                ids.add(record.image_id)
+        return ids
+
+    def versions(self):
+        '''Yield (region, records.LaunchTemplateVersion) for every cached version'''
+        with self._lock:
+            items = list(self._versions.items())
+        for (region, _, _), record in items:
+            yield region, record
+
+    def note_new_version(self, ec2_client, template_name, version_number):
+        '''Record a version this process created - it is now $Latest'''
+        self._set_alias((_region(ec2_client), template_name), '$Latest', version_number, overwrite=True)
+
+    def note_default_version(self, ec2_client, template_name, version_number):
+        '''Record that this process made version_number the $Default'''
+        self._set_alias((_region(ec2_client), template_name), '$Default', version_number, overwrite=True)
+
+    def _describe_templates(self, ec2_client, names):
+        region = _region(ec2_client)
+        try:
+            self._count_call()
+            paginator = ec2_client.get_paginator('describe_launch_templates')
+            templates = [t for page in paginator.paginate(LaunchTemplateNames=names) for t in page['LaunchTemplates']]
+        except ClientError as err:
+            if err.response['Error']['Code'] != NOT_FOUND_CODE:
+                raise
+            if len(names) == 1:
+                logger.warning("Launch template %s does not exist.", names[0])
+                return
+            for name in names: # one missing name fails the whole batch
+                self._describe_templates(ec2_client, [name])
+            return
+        for template in templates:
+            key = (region, template['LaunchTemplateName'])
+            with self._lock:
+                self._templates.setdefault(key, template)
+            # never overwrite an alias this process already moved
+            self._set_alias(key, '$Default', template['DefaultVersionNumber'])
+            self._set_alias(key, '$Latest', template['LatestVersionNumber'])
+
+    def _describe_versions(self, ec2_client, template_name, versions):
+        region = _region(ec2_client)
+        self._count_call()
+        response = ec2_client.describe_launch_template_versions(LaunchTemplateName=template_name, Versions=versions)
+        records = [LaunchTemplateVersion.from_api(entry) for entry in response['LaunchTemplateVersions']]
+        for record in records:
+            with self._lock:
+                self._versions[(region, template_name, record.version_number)] = record
+            if record.default_version:
+                self._set_alias((region, template_name), '$Default', record.version_number)
+        return records
+
+
+catalog = LaunchTemplateCatalog() # process wide catalogue shared by asg_info and analyze_ami_tags
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+'''Launch template tag helpers and a fleet-wide tag index with on-disk snapshots'''
+import argparse
+import gzip
+import json
+import os
+import tempfile
+import time
+
+VMA_KEY = 'Vendor_Managed_AMI'
+INSTANCE = 'instance'
+SNAPSHOT_FORMAT = 1
+
+
+def iter_tags(lt_data):
+    '''Yield (resource type, key, value) for every tag in a LaunchTemplateData'''
+    for spec in lt_data.get('TagSpecifications') or ():
+        resource_type = spec.get('ResourceType')
+        for tag in spec.get('Tags') or ():
+            yield resource_type, tag['Key'], tag.get('Value')
+
+
+def has_tag(lt_data, key=VMA_KEY, resource_type=INSTANCE):
+    return any(r == resource_type and k == key for r, k, _ in iter_tags(lt_data))
+
+
+def with_tag(lt_data, value, key=VMA_KEY, resource_type=INSTANCE):
+    '''TagSpecifications for a new version: every existing spec kept, key=value set on resource_type.
+
+    A spec for resource_type is added when the template has none.
+    '''
+    specs = []
+    found = False
+    for spec in lt_data.get('TagSpecifications') or ():
+        if spec.get('ResourceType') != resource_type: # keep other types intact
+            specs.append(spec)
+            continue
+        found = True
+        tags = [t for t in spec.get('Tags') or () if t['Key'] != key] # copy, preserves the other tags
+        tags.append({'Key': key, 'Value': value})
+        specs.append(dict(spec, Tags=tags))
+    if not found:
+        specs.append({'ResourceType': resource_type, 'Tags': [{'Key': key, 'Value': value}]})
+    return specs
+
+
+class TagIndex:
+    '''(resource type, tag key, tag value) -> launch template versions, plus image id -> versions.
+
+    A version is a (region, template name, version number) tuple. Lookups are
+    dict reads; lacking() is a set difference against every indexed version.
+    '''
+    def __init__(self):
+        self.created = time.time()
+        self.versions = set()
+        self._by_tag = {} # (resource type, key, value) -> set of versions
+        self._by_key = {} # (resource type, key) -> set of versions
+        self._by_image = {} # image id -> set of versions
+        self._images = {} # version -> image id
+
+    def add(self, region, entry):
+        '''Index one describe_launch_template_versions entry'''
+        version = (region, entry['LaunchTemplateName'], int(entry['VersionNumber']))
+        data = entry.get('LaunchTemplateData', {})
+        self._add(version, data.get('ImageId'), iter_tags(data))
+
+    def _add(self, version, image_id, tags):
+        self.versions.add(version)
+        if image_id:
+            self._images[version] = image_id
+            self._by_image.setdefault(image_id, set()).add(version)
+        for resource_type, key, value in tags:
+            self._by_tag.setdefault((resource_type, key, value), set()).add(version)
+            self._by_key.setdefault((resource_type, key), set()).add(version)
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        '''Index every version an lt_catalog.LaunchTemplateCatalog has loaded'''
+        index = cls()
+        for region, record in catalog.versions():
+            index._add((region, record.template_name, record.version_number), record.image_id, record.iter_tags())
+        return index
+
+    def with_tag(self, key, value=None, resource_type=INSTANCE):
+        '''Versions tagged key (=value, when given)'''
+        if value is None:
+            return self._by_key.get((resource_type, key), set())
+        return self._by_tag.get((resource_type, key, value), set())
+
+    def lacking(self, key=VMA_KEY, resource_type=INSTANCE):
+        return self.versions - self._by_key.get((resource_type, key), set())
+
+    def using_image(self, image_id):
+        return self._by_image.get(image_id, set())
+
+    def image_of(self, version):
+        return self._images.get(version)
+
+    def save(self, path):
+        '''Write a gzipped JSON snapshot: versions once, tags as lists of version positions'''
+        versions = sorted(self.versions)
+        position = {v: i for i, v in enumerate(versions)}
+        snapshot = {'format': SNAPSHOT_FORMAT, 'created': self.created,
+                    'versions': [[r, n, v, self._images.get((r, n, v))] for r, n, v in versions],
+                    'tags': [[r, k, val, sorted(position[v] for v in vs)]
+                             for (r, k, val), vs in sorted(self._by_tag.items(), key=lambda i: tuple(map(str, i[0])))]}
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            f.write(json.dumps(snapshot, separators=(',', ':')).encode('utf-8'))
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rb') as f:
+            snapshot = json.loads(f.read())
+        if snapshot.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"{path}: unsupported tag index snapshot format {snapshot.get('format')}")
+        index = cls()
+        index.created = snapshot['created']
+        tags = {}
+        for resource_type, key, value, positions in snapshot['tags']:
+            for i in positions:
+                tags.setdefault(i, []).append((resource_type, key, value))
+        for i, (region, name, number, image_id) in enumerate(snapshot['versions']):
+            index._add((region, name, number), image_id, tags.get(i, ()))
+        return index
+
+
+def _print_versions(versions, index):
+    for region, name, number in sorted(versions):
+        print(f"{region},{name},{number},{index.image_of((region, name, number)) or ''}")
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("snapshot", help="Tag index snapshot written by asg_info.py --tag_index")
+    argParser.add_argument("--lacking", help="List versions without this instance tag key", default=None)
+    argParser.add_argument("--tag", help="List versions with this instance tag, KEY or KEY=VALUE", default=None)
+    argParser.add_argument("--image", help="List versions using this AMI id", default=None)
+    args = argParser.parse_args()
+
+    index = TagIndex.load(args.snapshot)
+    print(f"{len(index.versions)} launch template versions, indexed {time.ctime(index.created)}")
+    if args.lacking:
+        _print_versions(index.lacking(args.lacking), index)
+    if args.tag:
+        key, _, value = args.tag.partition("=")
+        _print_versions(index.with_tag(key, value or None), index)
+    if args.image:
+        _print_versions(index.using_image(args.image), index)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+'''Compact records for the describe_* payloads the ASG tools keep - only the fields they read.
+
+from_api() copies those fields out at parse time; the raw response dict is
+kept on the record only when KEEP_RAW is set (or keep_raw=True is passed),
+e.g. for debugging, so large fleets do not hold every nested payload.
+'''
+import sys
+from typing import NamedTuple, Optional
+
+KEEP_RAW = False
+
+
+def _intern(value):
+    # names, versions and tag keys and values repeat across thousands of records
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _tag(key, value):
+    return {'Key': key} if value is None else {'Key': key, 'Value': value}
+
+
+class Asg(NamedTuple):
+    name: str
+    template_name: Optional[str] = None
+    template_version: Optional[str] = None
+    launch_configuration: Optional[str] = None
+    raw: Optional[dict] = None
+
+    @classmethod
+    def from_api(cls, group, keep_raw=None):
+        '''From one describe_auto_scaling_groups AutoScalingGroups entry'''
+        template = group.get('LaunchTemplate') or {}
+        return cls(group['AutoScalingGroupName'], _intern(template.get('LaunchTemplateName')),
+                   _intern(template.get('Version')), _intern(group.get('LaunchConfigurationName')),
+                   group if (KEEP_RAW if keep_raw is None else keep_raw) else None)
+
+
+class AmiInfo(NamedTuple):
+    '''What describe_images gives the tools about an AMI; unpacks like the old (location, name, owner) tuple'''
+    image_location: str = "none"
+    name: str = "none"
+    owner_id: str = "none"
+
+    @classmethod
+    def from_api(cls, image):
+        return cls(image.get('ImageLocation', "none"), image.get('Name', "none"), _intern(image.get('OwnerId', "none")))
+
+
+class LaunchTemplateVersion:
+    '''One describe_launch_template_versions entry, reduced to name, number, default flag, AMI and tags'''
+    __slots__ = ('template_name', 'version_number', 'default_version', 'image_id', 'tags', 'raw')
+
+    def __init__(self, template_name, version_number, default_version=False, image_id=None, tags=(), raw=None):
+        self.template_name = template_name
+        self.version_number = version_number
+        self.default_version = default_version
+        self.image_id = image_id
+        self.tags = tags # ((resource type, ((key, value), ...)), ...) in TagSpecifications order
+        self.raw = raw
+
+    @classmethod
+    def from_api(cls, entry, keep_raw=None):
+        data = entry.get('LaunchTemplateData') or {}
+        tags = tuple((_intern(spec.get('ResourceType')),
+                      tuple((_intern(t['Key']), _intern(t.get('Value'))) for t in spec.get('Tags') or ()))
+                     for spec in data.get('TagSpecifications') or ())
+        return cls(_intern(entry['LaunchTemplateName']), int(entry['VersionNumber']), bool(entry.get('DefaultVersion')),
+                   _intern(data.get('ImageId')), tags, entry if (KEEP_RAW if keep_raw is None else keep_raw) else None)
+
+    def iter_tags(self):
+        '''Yield (resource type, key, value) for every tag'''
+        for resource_type, tags in self.tags:
+            for key, value in tags:
+                yield resource_type, key, value
+
+    def has_tag(self, key, resource_type='instance'):
+        return any(r == resource_type and k == key for r, k, _ in self.iter_tags())
+
+    @property
+    def lt_data(self):
+        '''A LaunchTemplateData dict with the fields kept - ImageId and TagSpecifications'''
+        data = {}
+        if self.image_id is not None:
+            data['ImageId'] = self.image_id
+        if self.tags:
+            data['TagSpecifications'] = [{'ResourceType': r, 'Tags': [_tag(k, v) for k, v in tags]}
+                                         for r, tags in self.tags]
+        return data
+
+    def as_entry(self):
+        return {'LaunchTemplateName': self.template_name, 'VersionNumber': self.version_number,
+                'DefaultVersion': self.default_version, 'LaunchTemplateData': self.lt_data}
+
+    def as_response(self):
+        '''Shaped like a describe_launch_template_versions response for this one version'''
+        return {'LaunchTemplateVersions': [self.as_entry()]}
+
+    def __repr__(self):
+        return f"LaunchTemplateVersion({self.template_name!r}, {self.version_number}, image_id={self.image_id!r})"
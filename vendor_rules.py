@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+'''Vendor_Managed_AMI classification - rules loaded from JSON, compiled into hash lookups and one regex per field'''
+import json
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vendor_rules.json")
+VERDICTS = ("true", "false", "tbd")
+DEFAULT_VERDICT = "tbd"
+FIELDS = ('location', 'name') # checked in this order, after owner_ids
+
+
+class _FieldRules:
+    '''Location or name rules of one field.
+
+    Literal prefixes sit in a dict probed once per distinct prefix length,
+    longest first, so the most specific prefix wins at a cost of a few slices.
+    Regex patterns are joined into one anchored alternation, tried only when no
+    prefix matched; each pattern is its own group, so match.lastindex names it.
+    '''
+    def __init__(self, prefixes, patterns, ignore_case):
+        self.ignore_case = ignore_case
+        self.prefixes = {}
+        for prefix, verdict in prefixes:
+            self.prefixes.setdefault(prefix.casefold() if ignore_case else prefix, verdict)
+        self.lengths = sorted({len(p) for p in self.prefixes}, reverse=True)
+        self.regex, self.pattern_verdicts = None, ()
+        if patterns:
+            for pattern, _ in patterns:
+                if re.compile(pattern).groups:
+                    raise ValueError(f"vendor rule pattern {pattern!r} must not contain capturing groups, use (?:...)")
+            self.regex = re.compile("|".join(f"({p})" for p, _ in patterns), re.IGNORECASE if ignore_case else 0)
+            self.pattern_verdicts = tuple(v for _, v in patterns)
+
+    def match(self, value):
+        if not value:
+            return None
+        key = value.casefold() if self.ignore_case else value
+        for length in self.lengths:
+            verdict = self.prefixes.get(key[:length])
+            if verdict is not None:
+                return verdict
+        if self.regex is not None:
+            match = self.regex.match(value)
+            if match:
+                return self.pattern_verdicts[match.lastindex - 1]
+        return None
+
+
+class VendorRules:
+    '''Classifies an AMI as vendor managed ("true"), ours ("false") or unknown ("tbd").
+
+    Exact owner ids are a dict lookup; image location and name rules are
+    compiled by _FieldRules. First match wins in the order owner id,
+    location, name. Verdicts are memoized per AMI id.
+    '''
+    def __init__(self, rules=None):
+        rules = rules or {}
+        self.default = rules.get('default', DEFAULT_VERDICT)
+        self._owners = {}
+        self._fields = {}
+        for verdict, spec in rules.get('verdicts', {}).items():
+            if verdict not in VERDICTS:
+                raise ValueError(f"unknown verdict {verdict!r} in vendor rules, expected one of {VERDICTS}")
+            for owner_id in spec.get('owner_ids', ()):
+                self._owners[str(owner_id)] = verdict
+        ignore_case = rules.get('ignore_case', False)
+        for field in FIELDS:
+            prefixes = [(p, v) for v, spec in rules.get('verdicts', {}).items() for p in spec.get(f'{field}_prefixes', ())]
+            patterns = [(p, v) for v, spec in rules.get('verdicts', {}).items() for p in spec.get(f'{field}_patterns', ())]
+            self._fields[field] = _FieldRules(prefixes, patterns, ignore_case)
+        self._memo = {} # ami id -> verdict
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=RULES_FILE):
+        try:
+            with open(path) as f:
+                rules = json.load(f)
+        except FileNotFoundError:
+            logger.warning("Vendor rules file %s not found, every AMI classifies as %s", path, DEFAULT_VERDICT)
+            rules = {}
+        return cls(rules)
+
+    def classify(self, image_location, ami_name, owner_id, ami_id=None):
+        if ami_id is not None:
+            verdict = self._memo.get(ami_id)
+            if verdict is not None:
+                return verdict
+        verdict = self._owners.get(str(owner_id))
+        if verdict is None:
+            for field, value in zip(FIELDS, (image_location, ami_name)):
+                verdict = self._fields[field].match(value)
+                if verdict is not None:
+                    break
+            else:
+                verdict = self.default
+        if ami_id is not None:
+            with self._lock:
+                self._memo[ami_id] = verdict
+        return verdict
+
+
+_rules = None
+_rules_lock = threading.Lock()
+
+
+def get_rules():
+    '''Process wide rules, loaded from RULES_FILE on first use'''
+    global _rules
+    if _rules is None:
+        with _rules_lock:
+            if _rules is None:
+                _rules = VendorRules.load()
+    return _rules
+
+
+def classify(image_location, ami_name, owner_id, ami_id=None):
+    return get_rules().classify(image_location, ami_name, owner_id, ami_id)